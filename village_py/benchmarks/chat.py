@@ -0,0 +1,177 @@
+# run as `poetry run python benchmarks/chat.py [--clients 1000] [--output results.json]`
+#
+# Starts a chat server in its own process, connects idle SSE clients to it in
+# steps, and reports the server's resident memory per connected client and how
+# long one message takes to reach every client.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from village.chat import ChatServer
+from village.models.users import User, Username
+from village.repository import Repository
+
+SECRET_KEY = b"chat-benchmark"
+ROOM = "benchmark"
+
+
+def _run_server(path: str, port: int) -> None:
+    server = ChatServer(repository=Repository(path), secret_key=SECRET_KEY)
+    asyncio.run(server.serve(host="127.0.0.1", port=port))
+
+
+def _rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    raise Exception("no VmRSS")
+
+
+def _session_cookie(username: str) -> str:
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    assert serializer
+    return serializer.dumps({"username": username})
+
+
+async def _open_client(
+    port: int, cookie: str
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET /chat/api/{ROOM}/events HTTP/1.1\r\n"
+        f"Host: localhost\r\n"
+        f"Cookie: session={cookie}\r\n"
+        f"\r\n".encode("latin-1")
+    )
+    await writer.drain()
+    await reader.readuntil(b"retry: 2000\n\n")
+    return reader, writer
+
+
+async def _post_message(port: int, cookie: str, text: str) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = f"text={text}".encode("utf-8")
+    writer.write(
+        f"POST /chat/api/{ROOM}/messages HTTP/1.1\r\n"
+        f"Host: localhost\r\n"
+        f"Cookie: session={cookie}\r\n"
+        f"Content-Type: application/x-www-form-urlencoded\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = await reader.readline()
+    assert b" 204 " in status, status
+    writer.close()
+
+
+async def _run_benchmark(*, pid: int, port: int, clients: int, steps: int) -> dict:
+    cookie = _session_cookie("benchmark")
+
+    # the server may still be starting
+    for _ in range(100):
+        try:
+            await _post_message(port, cookie, "warm-up")
+            break
+        except ConnectionRefusedError:
+            await asyncio.sleep(0.1)
+
+    baseline_kb = _rss_kb(pid)
+    connections: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+    samples = []
+
+    for step in range(1, steps + 1):
+        target = clients * step // steps
+        while len(connections) < target:
+            batch = min(100, target - len(connections))
+            connections.extend(
+                await asyncio.gather(
+                    *(_open_client(port, cookie) for _ in range(batch))
+                )
+            )
+
+        await asyncio.sleep(0.5)
+        rss_kb = _rss_kb(pid)
+        samples.append(
+            {
+                "clients": len(connections),
+                "rss_kb": rss_kb,
+                "bytes_per_client": (rss_kb - baseline_kb) * 1024 / len(connections),
+            }
+        )
+
+    started_at = time.perf_counter()
+    await _post_message(port, cookie, "hello")
+    await asyncio.gather(*(reader.readuntil(b"hello") for reader, _ in connections))
+    fan_out_seconds = time.perf_counter() - started_at
+
+    return {
+        "baseline_rss_kb": baseline_kb,
+        "samples": samples,
+        "fan_out_seconds": fan_out_seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5901)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.clients + 100:
+        resource.setrlimit(
+            resource.RLIMIT_NOFILE, (min(hard, args.clients + 100), hard)
+        )
+
+    with tempfile.TemporaryDirectory() as path:
+        for directory in ("users", "posts", "uploads"):
+            os.makedirs(os.path.join(path, directory))
+        user = User.create_new_user(
+            username=Username("benchmark"), display_name="Benchmark", password="x"
+        )
+        Repository(path).create_user(user=user)
+
+        context = multiprocessing.get_context("spawn")
+        process = context.Process(target=_run_server, args=(path, args.port))
+        process.start()
+        try:
+            assert process.pid
+            results = asyncio.run(
+                _run_benchmark(
+                    pid=process.pid,
+                    port=args.port,
+                    clients=args.clients,
+                    steps=args.steps,
+                )
+            )
+        finally:
+            process.terminate()
+            process.join()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "wt") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# run as `poetry run python benchmarks/post_memory.py [--posts 20000] [--output results.json]`
+#
+# Generates a synthetic repository and reports how many bytes each post's
+# cached metadata takes, held as Post models and as the PostRecords the
+# repository keeps, and for the repository's post cache as a whole.
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from village.models.posts import Post
+from village.post_records import PostRecord
+from village.repository import Repository
+from village.scripts.generate_repository import GeneratorSettings, generate_repository
+
+
+def bytes_retained(build: Callable[[], object]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        retained = build()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    del retained
+    return after - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        generate_repository(
+            path, GeneratorSettings(posts=args.posts, avatar_fraction=0.0)
+        )
+
+        repository = Repository(path)
+        repository.load_all_top_level_posts()
+        # fresh copies of the metadata, as if each had just been read from disk
+        encoded = json.dumps(
+            [record.to_dict() for record in repository._posts.values()]
+        )
+        del repository
+
+        post_count = len(json.loads(encoded))
+        results = {
+            "posts": post_count,
+            "bytes_per_post": {
+                "post_model": bytes_retained(
+                    lambda: [Post.model_validate(data) for data in json.loads(encoded)]
+                )
+                / post_count,
+                "post_record": bytes_retained(
+                    lambda: [
+                        PostRecord.from_trusted_dict(data)
+                        for data in json.loads(encoded)
+                    ]
+                )
+                / post_count,
+                "repository": bytes_retained(lambda: _loaded_repository(path))
+                / post_count,
+            },
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "wt") as f:
+            f.write(output)
+    print(output)
+
+
+def _loaded_repository(path: str) -> Repository:
+    # everything the repository keeps per post: records, file signatures and
+    # the post graph
+    repository = Repository(path)
+    repository.load_all_top_level_posts()
+    return repository
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# run as `poetry run python benchmarks/startup.py [--posts 5000] [--runs 5]
+#                                                 [--output results.json]`
+#
+# Generates a synthetic repository and starts the app in fresh processes
+# against it, reporting how long `import village.app` takes, how long until
+# the first request to / succeeds, then the first to /posts, and how long
+# until /ready?warm=1 does, i.e. until the background warm-up has filled the
+# caches. The first start builds the on-disk caches and is left out.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+VILLAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, VILLAGE_PATH)
+
+from village.scripts.generate_repository import GeneratorSettings, generate_repository
+
+# runs in each fresh process; times are from just before the import
+CHILD_SCRIPT = """
+import json, sys, time
+
+started_at = time.perf_counter()
+import village.app
+imported_at = time.perf_counter()
+
+client = village.app.app.test_client()
+while client.get("/").status_code != 200:
+    time.sleep(0.001)
+first_request_at = time.perf_counter()
+
+with client.session_transaction() as session:
+    session["username"] = sys.argv[1]
+assert client.get("/posts").status_code == 200
+first_posts_page_at = time.perf_counter()
+
+while True:
+    response = client.get("/ready?warm=1")
+    # 404 from a tree without warm-up: it was all done during the import
+    if response.status_code in (200, 404):
+        break
+    time.sleep(0.001)
+warmed_up_at = time.perf_counter()
+
+print(json.dumps({
+    "import_seconds": imported_at - started_at,
+    "first_request_seconds": first_request_at - started_at,
+    "first_posts_page_seconds": first_posts_page_at - started_at,
+    "warmed_up_seconds": warmed_up_at - started_at,
+}))
+"""
+
+
+def start_app(home: str, *, username: str) -> dict:
+    started_at = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, username],
+        cwd=VILLAGE_PATH,
+        env={
+            **os.environ,
+            "HOME": home,
+            "FLASK_SECRET_KEY": "startup-benchmark",
+            "PYTHONPATH": VILLAGE_PATH,
+        },
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    # including the interpreter's own startup
+    result["process_seconds"] = time.perf_counter() - started_at
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        repository = generate_repository(
+            os.path.join(home, "test-repository"),
+            GeneratorSettings(posts=args.posts, avatar_fraction=0.0),
+        )
+        username = repository.load_all_users()[0].username
+
+        start_app(home, username=username)
+        runs = [start_app(home, username=username) for _ in range(args.runs)]
+
+    results = {
+        "posts": args.posts,
+        "runs": args.runs,
+        **{
+            key: {
+                "min_seconds": min(run[key] for run in runs),
+                "median_seconds": statistics.median(run[key] for run in runs),
+            }
+            for key in (
+                "import_seconds",
+                "first_request_seconds",
+                "first_posts_page_seconds",
+                "warmed_up_seconds",
+                "process_seconds",
+            )
+        },
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "wt") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# run as `poetry run python benchmarks/suite.py [--output results.json]
+#                                               [--compare previous.json]`
+#
+# Generates a synthetic repository and times the hot paths of the server
+# against it. Results are JSON so that runs from different commits can be
+# compared; with --compare, any benchmark that got slower than --threshold
+# is reported and the exit status is non-zero.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from village.images.thumbnails import make_thumbnail
+from village.rendering import RenderCache
+from village.repository import Repository
+from village.scripts.generate_repository import (
+    GENERATED_PASSWORD,
+    GeneratorSettings,
+    generate_repository,
+)
+
+
+def time_calls(function: Callable[[], object], *, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started_at)
+
+    return {
+        "repeat": repeat,
+        "min_seconds": min(durations),
+        "median_seconds": statistics.median(durations),
+        "max_seconds": max(durations),
+    }
+
+
+def run_benchmarks(path: str, *, repeat: int, sample_size: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    results = {}
+
+    results["load_all_top_level_posts.cold"] = time_calls(
+        lambda: Repository(path).load_all_top_level_posts(), repeat=repeat
+    )
+
+    repository = Repository(path)
+    top_level_posts = repository.load_all_top_level_posts()
+    results["load_all_top_level_posts.warm"] = time_calls(
+        repository.load_all_top_level_posts, repeat=repeat
+    )
+
+    threads = [
+        repository.load_posts(top_post_id=post.id)
+        for post in rng.sample(top_level_posts, min(sample_size, len(top_level_posts)))
+    ]
+    results["load_posts"] = time_calls(
+        lambda: [repository.load_posts(top_post_id=t[0].id) for t in threads],
+        repeat=repeat,
+    )
+
+    posts = [post for thread in threads for post in thread]
+    results["load_post_content"] = time_calls(
+        lambda: [repository.load_post_content(post_id=post.id) for post in posts],
+        repeat=repeat,
+    )
+
+    results["calculate_tail_context"] = time_calls(
+        lambda: [
+            repository.post_graph.calculate_tail_context(post.id for post in thread)
+            for thread in threads
+        ],
+        repeat=repeat,
+    )
+
+    contents = [repository.load_post_content(post_id=post.id) for post in posts]
+    uncached_renderer = RenderCache(max_bytes=0)
+    results["render_markdown"] = time_calls(
+        lambda: [uncached_renderer.render_markdown(content) for content in contents],
+        repeat=repeat,
+    )
+
+    users = repository.load_all_users()
+    results["check_password"] = time_calls(
+        lambda: users[0].check_password(password=GENERATED_PASSWORD), repeat=repeat
+    )
+
+    avatars = [
+        repository.upload_path_for(filename=user.image_filename)
+        for user in users
+        if user.image_filename
+    ][:sample_size]
+
+    def make_avatar_thumbnails() -> None:
+        for avatar in avatars:
+            with Image.open(avatar) as img:
+                make_thumbnail(img)
+
+    results["make_thumbnail"] = time_calls(make_avatar_thumbnails, repeat=repeat)
+
+    for name, result in results.items():
+        result["items"] = {
+            "load_posts": len(threads),
+            "load_post_content": len(posts),
+            "calculate_tail_context": len(threads),
+            "render_markdown": len(contents),
+            "make_thumbnail": len(avatars),
+        }.get(name, 1)
+
+    return results
+
+
+def compare(results: dict, previous: dict, *, threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        previous_result = previous["benchmarks"].get(name)
+        if previous_result is None:
+            continue
+
+        ratio = result["min_seconds"] / previous_result["min_seconds"]
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{name}: {previous_result['min_seconds']:.6f}s -> "
+                f"{result['min_seconds']:.6f}s ({ratio:.2f}x)"
+            )
+
+    return regressions
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    defaults = GeneratorSettings(avatar_max_side=3000)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--max-depth", type=int, default=defaults.max_depth)
+    parser.add_argument("--max-fan-out", type=int, default=defaults.max_fan_out)
+    parser.add_argument(
+        "--median-body-words", type=int, default=defaults.median_body_words
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sample-size", type=int, default=20)
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    settings = GeneratorSettings(
+        users=args.users,
+        posts=args.posts,
+        max_depth=args.max_depth,
+        max_fan_out=args.max_fan_out,
+        median_body_words=args.median_body_words,
+        avatar_max_side=defaults.avatar_max_side,
+        seed=args.seed,
+    )
+
+    with tempfile.TemporaryDirectory() as path:
+        started_at = time.perf_counter()
+        generate_repository(path, settings)
+        generation_seconds = time.perf_counter() - started_at
+
+        benchmarks = run_benchmarks(
+            path, repeat=args.repeat, sample_size=args.sample_size, seed=args.seed
+        )
+
+    results = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "settings": vars(settings),
+        "generation_seconds": generation_seconds,
+        "benchmarks": benchmarks,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "wt") as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), threshold=args.threshold)
+
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# run as `poetry run python benchmarks/thumbnails.py [--output results.json]`
+#
+# Compares the original thumbnail code (copied below as the baseline) with
+# village.images.thumbnails on a large JPEG photo and a long animated GIF.
+# Every measurement runs in a fresh process so that peak RSS is meaningful.
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from PIL import Image as PILImage
+from PIL.Image import Image, Resampling
+from PIL.ImageOps import exif_transpose
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from village.images.thumbnails import THUMBNAIL_SIZE, make_and_save_thumbnail
+
+
+def baseline_make_and_save_thumbnail(img: Image, filename: str) -> None:
+    thumbnail, extra_frames = _baseline_make_thumbnail(img)
+
+    with open(filename, "wb") as f:
+        if extra_frames:
+            thumbnail.save(
+                f, format=img.format, save_all=True, append_images=extra_frames
+            )
+        else:
+            thumbnail.save(f, format=img.format)
+
+
+def _baseline_make_thumbnail(img: Image) -> tuple[Image, Optional[list[Image]]]:
+    if not hasattr(img, "n_frames"):
+        return _baseline_make_simple_thumbnail(img), None
+
+    thumbnail = _baseline_make_simple_thumbnail(img)
+
+    extra_frames = []
+    for frame in range(1, img.n_frames):
+        img.seek(frame)
+        extra_frames.append(_baseline_make_simple_thumbnail(img))
+
+        if len(extra_frames) > 1000:
+            break
+
+    return thumbnail, extra_frames
+
+
+def _baseline_make_simple_thumbnail(img: Image) -> Image:
+    thumbnail = exif_transpose(img, in_place=False)
+    assert thumbnail
+
+    square_dim = min(thumbnail.width, thumbnail.height)
+    half_extra_width = int((thumbnail.width - square_dim) / 2)
+    half_extra_height = int((thumbnail.height - square_dim) / 2)
+
+    thumbnail = thumbnail.crop(
+        (
+            half_extra_width,
+            half_extra_height,
+            half_extra_width + square_dim,
+            half_extra_height + square_dim,
+        )
+    )
+    thumbnail.thumbnail(THUMBNAIL_SIZE, resample=Resampling.LANCZOS)
+
+    return thumbnail
+
+
+IMPLEMENTATIONS = {
+    "baseline": baseline_make_and_save_thumbnail,
+    "current": make_and_save_thumbnail,
+}
+
+
+def make_inputs(directory: str, *, gif_frames: int) -> dict[str, str]:
+    photo_path = os.path.join(directory, "photo.jpg")
+    photo = PILImage.radial_gradient("L").resize((6000, 4000)).convert("RGB")
+    photo = PILImage.blend(
+        photo, PILImage.effect_noise((6000, 4000), 64).convert("RGB"), 0.5
+    )
+    photo.save(photo_path, format="JPEG", quality=90)
+
+    gif_path = os.path.join(directory, "animation.gif")
+    frames = [
+        PILImage.linear_gradient("L")
+        .rotate(frame * 360 / gif_frames)
+        .resize((800, 600))
+        .convert("P")
+        for frame in range(gif_frames)
+    ]
+    frames[0].save(
+        gif_path, format="GIF", save_all=True, append_images=frames[1:], duration=40
+    )
+
+    return {"large_photo": photo_path, "long_gif": gif_path}
+
+
+def _peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _measure(implementation: str, source: str, destination: str, queue) -> None:
+    _reset_peak_rss()
+    rss_before = _peak_rss_kb()
+
+    started_at = time.perf_counter()
+    # the request path validates with a full load before the job runs, the
+    # job itself hands the thumbnail code a freshly opened, unloaded image
+    with PILImage.open(source) as img:
+        if implementation == "baseline":
+            img.load()
+        IMPLEMENTATIONS[implementation](img, destination)
+    elapsed = time.perf_counter() - started_at
+
+    queue.put({"seconds": elapsed, "peak_rss_increase_kb": _peak_rss_kb() - rss_before})
+
+
+def measure(implementation: str, source: str, destination: str) -> dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(
+        target=_measure, args=(implementation, source, destination, queue)
+    )
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gif-frames", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, dict]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = make_inputs(directory, gif_frames=args.gif_frames)
+
+        for input_name, source in inputs.items():
+            results[input_name] = {}
+            for implementation in IMPLEMENTATIONS:
+                runs = [
+                    measure(
+                        implementation,
+                        source,
+                        os.path.join(directory, f"{implementation}-{input_name}"),
+                    )
+                    for _ in range(args.repeat)
+                ]
+                results[input_name][implementation] = {
+                    "seconds": min(run["seconds"] for run in runs),
+                    "peak_rss_increase_kb": min(
+                        run["peak_rss_increase_kb"] for run in runs
+                    ),
+                }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "wt") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
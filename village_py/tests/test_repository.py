@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from village.models.posts import Post, new_time_ordered_post_id
+from village.models.users import Username
+from village.repository import Repository
+
+
+class RepositoryTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.base_path = temporary_directory.name
+        os.makedirs(os.path.join(self.base_path, "users"))
+        os.makedirs(os.path.join(self.base_path, "posts"))
+
+    def create_post(self, *, timestamp: datetime, title: str, content: str) -> Post:
+        post = Post(
+            id=new_time_ordered_post_id(timestamp),
+            author=Username("alice"),
+            timestamp=timestamp,
+            title=title,
+            context=[],
+            upload_filename=None,
+        )
+        Repository(self.base_path).create_post(post=post, content=content)
+        return post
+
+
+class CrlfPostFileTest(RepositoryTestCase):
+    def test_post_file_with_crlf_line_endings(self) -> None:
+        post = self.create_post(
+            timestamp=datetime(2024, 1, 1, 12, 0, 0),
+            title="Hello",
+            content="first line\nsecond line\n",
+        )
+
+        # as if the file had been edited on Windows
+        path = Repository(self.base_path)._post_path(post.id)
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data.replace(b"\n", b"\r\n"))
+
+        repository = Repository(self.base_path)
+        self.assertEqual(
+            [loaded.title for loaded in repository.load_all_top_level_posts()],
+            ["Hello"],
+        )
+        self.assertEqual(
+            repository.load_post_content(post_id=post.id),
+            "first line\nsecond line\n",
+        )
+
+
+class PostsSinceTest(RepositoryTestCase):
+    def test_range_scan_reads_only_newer_shards(self) -> None:
+        old_post = self.create_post(
+            timestamp=datetime(2023, 5, 1, 12, 0, 0), title="old", content=""
+        )
+        self.create_post(
+            timestamp=datetime(2024, 2, 1, 12, 0, 0), title="earlier", content=""
+        )
+        self.create_post(
+            timestamp=datetime(2024, 2, 20, 12, 0, 0), title="later", content=""
+        )
+        self.create_post(
+            timestamp=datetime(2024, 3, 1, 12, 0, 0), title="newest", content=""
+        )
+
+        # anything read from the older shards would now fail to load
+        with open(Repository(self.base_path)._post_path(old_post.id), "wt") as f:
+            f.write("not: [a post\n")
+
+        repository = Repository(self.base_path)
+        since = datetime(2024, 2, 15, 13, 0, 0, tzinfo=timezone(timedelta(hours=1)))
+        scanned_shards = {
+            os.path.relpath(os.path.dirname(entry.path), self.base_path)
+            for entry in repository._scan_post_files(since=since)
+        }
+        self.assertEqual(
+            scanned_shards,
+            {os.path.join("posts", "2024", "02"), os.path.join("posts", "2024", "03")},
+        )
+        self.assertEqual(
+            [post.title for post in repository.load_posts_since(since=since)],
+            ["later", "newest"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
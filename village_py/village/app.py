@@ -1,39 +1,237 @@
+import hashlib
+import mimetypes
 import os
+import time
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
 
-from bleach import clean
-from bleach.sanitizer import ALLOWED_TAGS
 from flask import (
     Flask,
+    abort,
+    before_render_template,
     g,
+    jsonify,
     redirect,
     render_template,
     request,
     send_from_directory,
     session,
+    template_rendered,
     url_for,
 )
-from markdown import markdown
-from PIL import Image
 
 from village.models.users import Username
 from village.models.posts import PostID, Post
-from village.repository import Repository
-from village.images.thumbnails import make_and_save_thumbnail
-from village.post_graph import calculate_tail_context
-
-OUR_ALLOWED_TAGS = frozenset(
-    ALLOWED_TAGS | {"p", "em", "hr"} | {f"h{n}" for n in range(1, 6 + 1)}
+from village.post_graph import PostCursor
+from village.metrics import Sample, format_server_timing, global_metrics
+from village.passwords import PasswordHasherSaturatedException, global_password_hasher
+from village.repository import ContentVersion, Repository
+from village.images.ingest import ingest_image_upload
+from village.images.jobs import ThumbnailJobQueue
+from village.images.variant_files import (
+    NEGOTIATED_FORMATS,
+    VARIANT_SIZES,
+    variant_filename,
+    variant_size_for_width,
 )
+from village.rendering import OUR_ALLOWED_TAGS, RenderCache
+from village.warm_up import WarmUp
 
 app = Flask(__name__)
 app.secret_key = os.environ["FLASK_SECRET_KEY"].encode("utf-8")
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1000 * 1000  # 16 MB
 
+POSTS_PAGE_SIZE = 50
+MAX_POSTS_PAGE_SIZE = 200
+SEARCH_RESULTS_LIMIT = 50
+
+# upload filenames are never reused, so their contents never change
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# e.g. "/_uploads/", an nginx `internal` location aliased to the uploads directory
+UPLOADS_ACCEL_REDIRECT_PREFIX = os.environ.get("VILLAGE_UPLOADS_ACCEL_REDIRECT")
+
+# changes whenever the templates do, so that cached pages are re-rendered
+PAGE_TEMPLATES_VERSION = hashlib.sha256(
+    repr(
+        sorted(
+            (entry.name, entry.stat().st_mtime_ns)
+            for entry in os.scandir(
+                os.path.join(os.path.dirname(__file__), "templates")
+            )
+        )
+    ).encode("utf-8")
+).hexdigest()
+
+# posts rendered ahead of time by the warm-up, at about a millisecond each
+WARM_UP_RENDERED_POSTS = 500
+
+# adds a Server-Timing header with the per-phase breakdown to every response
+SERVER_TIMING_ENABLED = bool(os.environ.get("VILLAGE_SERVER_TIMING"))
+
+
+global_repository = Repository(
+    os.path.expanduser("~/test-repository"),
+    use_snapshot=True,
+    use_search_index=True,
+    full_rescan_seconds=float(os.environ.get("VILLAGE_FULL_RESCAN_SECONDS", 60)),
+)
+
+global_render_cache = RenderCache(
+    max_bytes=int(os.environ.get("VILLAGE_RENDER_CACHE_BYTES", 64 * 1000 * 1000)),
+    persist_path=(
+        os.path.join(global_repository.cache_path, "rendered/")
+        if os.environ.get("VILLAGE_RENDER_CACHE_ON_DISK")
+        else None
+    ),
+    allowed_tags=OUR_ALLOWED_TAGS,
+)
+
+global_thumbnail_jobs = ThumbnailJobQueue(
+    repository=global_repository,
+    max_workers=int(os.environ.get("VILLAGE_THUMBNAIL_WORKERS", 1)),
+)
+
+
+def warm_search_index() -> None:
+    if global_repository.search_index is not None:
+        global_repository.search_index.load()
+
+
+def warm_render_cache() -> None:
+    # the threads on the first page of /posts, where most visits start, up to
+    # WARM_UP_RENDERED_POSTS posts between them
+    posts, _ = global_repository.load_top_level_posts_page(
+        before=None, limit=POSTS_PAGE_SIZE
+    )
+    rendered = 0
+    for top_post in posts:
+        for post in global_repository.load_posts(top_post_id=top_post.id):
+            if rendered >= WARM_UP_RENDERED_POSTS:
+                return
+
+            global_render_cache.render_markdown(
+                global_repository.load_post_content(post_id=post.id)
+            )
+            rendered += 1
+
+
+# filling the caches takes a while on a large repository, so it is done in the
+# background rather than before the first request can be served
+global_warm_up = WarmUp(
+    steps=[
+        ("search_index", warm_search_index),
+        ("users", global_repository.load_all_users),
+        ("posts", global_repository.load_all_top_level_posts),
+        ("render_cache", warm_render_cache),
+        ("thumbnail_jobs", global_thumbnail_jobs.resume),
+    ]
+)
+
+
+def collect_cache_metrics():
+    for name, stats in (
+        ("users", global_repository.user_cache_stats),
+        ("posts", global_repository.post_cache_stats),
+    ):
+        for field in ("hits", "reloads", "removals"):
+            yield Sample(
+                name=f"village_repository_cache_{field}_total",
+                kind="counter",
+                help=f"Repository cache {field}.",
+                value=getattr(stats, field),
+                labels=(("cache", name),),
+            )
+
+    for field in ("hits", "disk_hits", "misses", "evictions"):
+        yield Sample(
+            name=f"village_render_cache_{field}_total",
+            kind="counter",
+            help=f"Render cache {field}.",
+            value=getattr(global_render_cache.stats, field),
+        )
+    yield Sample(
+        name="village_render_cache_bytes",
+        kind="gauge",
+        help="Approximate size of the in-memory render cache.",
+        value=global_render_cache.size,
+    )
+    yield Sample(
+        name="village_warmed_up",
+        kind="gauge",
+        help="Whether the background warm-up of the caches has finished.",
+        value=1 if global_warm_up.finished else 0,
+    )
+
+    hasher_stats = global_password_hasher.stats
+    yield Sample(
+        name="village_password_hashes_in_flight",
+        kind="gauge",
+        help="Password hashes running or queued.",
+        value=hasher_stats.in_flight,
+    )
+    for field in ("completed", "rejected"):
+        yield Sample(
+            name=f"village_password_hashes_{field}_total",
+            kind="counter",
+            help=f"Password hashes {field}.",
+            value=getattr(hasher_stats, field),
+        )
+    for field in ("queue_wait_seconds", "hash_seconds"):
+        yield Sample(
+            name=f"village_password_hash_{field}_total",
+            kind="counter",
+            help=f"Total password hash {field.replace('_', ' ')}.",
+            value=getattr(hasher_stats, f"{field}_total"),
+        )
+
+
+global_metrics.add_collector(collect_cache_metrics)
+
+
+@app.before_request
+def start_request_timing():
+    g.request_started_at = time.perf_counter()
+    g.request_timings = global_metrics.start_request(
+        route=request.url_rule.rule if request.url_rule else "unmatched"
+    )
+
+
+@app.after_request
+def finish_request_timing(response):
+    timings = g.pop("request_timings", None)
+    if timings is None:
+        return response
+
+    seconds = time.perf_counter() - g.request_started_at
+    global_metrics.finish_request(
+        timings=timings,
+        method=request.method,
+        status=response.status_code,
+        seconds=seconds,
+    )
+
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = format_server_timing(
+            timings, total_seconds=seconds
+        )
+
+    return response
 
-global_repository = Repository(os.path.expanduser("~/test-repository"))
-global_repository.load_all_users()
+
+@before_render_template.connect_via(app)
+def start_template_timing(sender, template, context, **extra):
+    g.template_started_at = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def finish_template_timing(sender, template, context, **extra):
+    started_at = g.pop("template_started_at", None)
+    if started_at is not None:
+        global_metrics.observe_phase(
+            phase="template", seconds=time.perf_counter() - started_at
+        )
 
 
 def requires_logged_in_user(f):
@@ -45,7 +243,7 @@ def requires_logged_in_user(f):
             return redirect(url_for("index"))
 
         try:
-            user = global_repository.load_user(username=username)
+            user = global_repository.get_user(username=username)
         except Exception as e:
             print(f"could not find user: {username}")
             return redirect(url_for("index"))
@@ -57,6 +255,15 @@ def requires_logged_in_user(f):
     return wrapper
 
 
+@app.errorhandler(PasswordHasherSaturatedException)
+def password_hasher_saturated(e: PasswordHasherSaturatedException):
+    return (
+        "Too many logins in progress, please try again shortly.",
+        503,
+        {"Retry-After": "1"},
+    )
+
+
 @app.route("/")
 def index() -> str:
     return render_template("index.html")
@@ -64,10 +271,115 @@ def index() -> str:
 
 @app.route("/uploads/<filename>")
 def get_upload(filename: str):
-    return send_from_directory(
-        global_repository.uploads_path,
-        filename,
+    if filename.startswith("."):
+        abort(404)
+
+    # with ?w=, the smallest variant at least that wide, in the best format the
+    # client accepts; the original until the variants have been made
+    negotiated = pending = False
+    width = request.args.get("w", type=int)
+    if width is not None and width > 0:
+        negotiated = True
+        variant = _upload_variant_filename(filename, width=width)
+        filename = variant or filename
+        pending = variant is None
+
+    if request.if_none_match.contains(filename):
+        response = app.response_class(status=304)
+
+    elif UPLOADS_ACCEL_REDIRECT_PREFIX and not pending:
+        mimetype, _ = mimetypes.guess_type(filename)
+        response = app.response_class(mimetype=mimetype or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = UPLOADS_ACCEL_REDIRECT_PREFIX + filename
+
+    else:
+        response = send_from_directory(
+            global_repository.uploads_path,
+            filename,
+            etag=False,
+            max_age=UPLOAD_CACHE_MAX_AGE,
+        )
+
+    response.set_etag(filename)
+    response.cache_control.public = True
+    if negotiated:
+        response.vary.add("Accept")
+
+    if pending:
+        # the variants are still being made; check back for them next time
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = UPLOAD_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+
+    return response
+
+
+def _upload_variant_filename(filename: str, *, width: int) -> Optional[str]:
+    _, extension = os.path.splitext(filename)
+    extensions = [
+        variant_extension
+        for _, variant_extension, mimetype in NEGOTIATED_FORMATS
+        if _accepts_explicitly(mimetype)
+    ] + [extension[1:]]
+
+    size = variant_size_for_width(width)
+    # wide enough first; smaller ones in case the image itself is smaller
+    sizes = [s for s in VARIANT_SIZES if s >= size] + [
+        s for s in reversed(VARIANT_SIZES) if s < size
+    ]
+
+    for size in sizes:
+        for variant_extension in extensions:
+            candidate = variant_filename(
+                filename, size=size, extension=variant_extension
+            )
+            if os.path.exists(global_repository.upload_path_for(filename=candidate)):
+                return candidate
+
+    return None
+
+
+def _accepts_explicitly(mimetype: str) -> bool:
+    # browsers send */* along with the image types they can actually decode
+    return any(
+        value == mimetype and quality > 0 for value, quality in request.accept_mimetypes
+    )
+
+
+@app.template_global()
+def upload_srcset(filename: str, widths: list[int]) -> str:
+    return ", ".join(
+        f"{url_for('get_upload', filename=filename, w=width)} {width}w"
+        for width in widths
+    )
+
+
+@app.route("/metrics")
+def metrics():
+    return app.response_class(
+        global_metrics.render_prometheus(),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+@app.route("/ready")
+def ready():
+    # a worker takes requests as soon as it has started, with the caches
+    # filling in the background; with ?warm=1 it only reports ready once
+    # they are full
+    is_ready = global_warm_up.finished or not request.args.get("warm")
+
+    response = jsonify(
+        status="ready" if is_ready else "warming up",
+        warmed_up=global_warm_up.finished,
+        warm_up_seconds=global_warm_up.step_seconds,
+        warm_up_errors=global_warm_up.errors,
     )
+    response.status_code = 200 if is_ready else 503
+    response.cache_control.no_store = True
+    return response
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -80,10 +392,14 @@ def login():
             username = Username(request.form["username"])
             password = request.form["password"]
 
-            user = global_repository.load_user(username=username)
+            user = global_repository.get_user(username=username)
             if not user.check_password(password=password):
                 raise Exception("password does not match")
 
+            if user.password_needs_rehash():
+                user.rehash_password(password=password)
+                global_repository.update_user(user=user)
+
             session["username"] = username
 
             if user.new_password_required:
@@ -91,6 +407,9 @@ def login():
 
             return redirect(url_for("index"))
 
+        except PasswordHasherSaturatedException:
+            raise
+
         except Exception as e:
             error = str(e)
 
@@ -117,7 +436,7 @@ def update_password():
             if new_password != new_password_again:
                 raise Exception("new passwords do not match")
 
-            user = global_repository.load_user(username=username)
+            user = global_repository.get_user(username=username)
             if not user.check_password(password=current_password):
                 raise Exception("current password does not match")
 
@@ -130,31 +449,103 @@ def update_password():
 
             return redirect(url_for("logout"))
 
+        except PasswordHasherSaturatedException:
+            raise
+
         except Exception as e:
             error = str(e)
 
     return render_template("update_password.html", username=username, error=error)
 
 
+def _page_etag(version: ContentVersion, *extra: object) -> str:
+    # pages also depend on who is looking, and on the templates themselves
+    h = hashlib.sha256(PAGE_TEMPLATES_VERSION.encode("utf-8"))
+    h.update(version.token.encode("utf-8"))
+    h.update(repr((g.user.username,) + extra).encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def _not_modified(*, etag: str, version: ContentVersion):
+    if request.if_none_match:
+        unchanged = request.if_none_match.contains(etag)
+    else:
+        unchanged = bool(
+            request.if_modified_since
+            and version.last_modified <= request.if_modified_since
+        )
+
+    if not unchanged:
+        return None
+
+    return _with_validators(app.response_class(status=304), etag=etag, version=version)
+
+
+def _with_validators(response, *, etag: str, version: ContentVersion):
+    response = app.make_response(response)
+    response.set_etag(etag)
+    response.last_modified = version.last_modified
+    # pages differ per user, and must be revalidated on every visit
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route("/users")
 @requires_logged_in_user
 def list_users():
     users = global_repository.load_all_users()
     users.sort(key=lambda u: (u.display_name, u.username))
 
-    return render_template("users.html", users=users)
+    version = global_repository.content_version(
+        usernames=[user.username for user in users]
+    )
+    etag = _page_etag(version)
+    if not_modified := _not_modified(etag=etag, version=version):
+        return not_modified
+
+    return _with_validators(
+        render_template("users.html", users=users), etag=etag, version=version
+    )
 
 
 @app.route("/users/<username>")
 @requires_logged_in_user
 def user_profile(username: Username):
-    user = global_repository.load_user(username=username)
-    content = clean(
-        markdown(global_repository.load_user_content(username=username)),
-        tags=OUR_ALLOWED_TAGS,
+    user = global_repository.get_user(username=username)
+    thumbnail_job = global_thumbnail_jobs.status_for(username=username)
+
+    version = global_repository.content_version(usernames=[username])
+    etag = _page_etag(version, thumbnail_job.status if thumbnail_job else None)
+    if not_modified := _not_modified(etag=etag, version=version):
+        return not_modified
+
+    content = global_render_cache.render_markdown(
+        global_repository.load_user_content(username=username)
     )
 
-    return render_template("user_profile.html", user=user, content=content)
+    return _with_validators(
+        render_template(
+            "user_profile.html",
+            user=user,
+            content=content,
+            thumbnail_job=thumbnail_job,
+        ),
+        etag=etag,
+        version=version,
+    )
+
+
+@app.route("/users/<username>/thumbnail")
+@requires_logged_in_user
+def user_thumbnail_status(username: Username):
+    user = global_repository.get_user(username=username)
+    job = global_thumbnail_jobs.status_for(username=username)
+
+    return jsonify(
+        status=job.status if job else "done",
+        image_thumbnail=user.image_thumbnail,
+    )
 
 
 @app.route("/users/<username>/edit", methods=["GET", "POST"])
@@ -186,49 +577,31 @@ def edit_user_profile(username: Username):
                 if not new_image_file.filename:
                     raise Exception("somehow missing an image filename")
 
-                _, extension = os.path.splitext(new_image_file.filename)
-
-                img = Image.open(
-                    new_image_file,
-                    formats=(
-                        "GIF",
-                        "JPEG",
-                        "PNG",
-                    ),
-                )
-                img.load()
-                new_image_file.seek(0)
-
-                new_upload_filename = global_repository.new_upload_filename(
-                    suffix=extension
-                )
-                new_image_file.save(
-                    global_repository.upload_path_for(filename=new_upload_filename)
-                )
+                new_upload_filename = ingest_image_upload(
+                    new_image_file.stream,
+                    uploads_path=global_repository.uploads_path,
+                ).filename
                 g.user.image_filename = new_upload_filename
-
-                new_thumbnail_filename = global_repository.new_upload_filename(
-                    suffix=extension
-                )
-                make_and_save_thumbnail(
-                    img,
-                    global_repository.upload_path_for(filename=new_thumbnail_filename),
-                )
-                g.user.image_thumbnail = new_thumbnail_filename
+                g.user.image_thumbnail = new_upload_filename
+                g.user.image_variant_widths = []
 
             global_repository.update_user(user=g.user)
             global_repository.update_user_content(
                 username=g.user.username, content=new_content
             )
 
+            if new_image_file:
+                global_thumbnail_jobs.submit(
+                    username=g.user.username, source_filename=new_upload_filename
+                )
+
             return redirect(url_for("user_profile", username=username))
 
         except Exception as e:
             error = str(e)
 
-    content = clean(
-        global_repository.load_user_content(username=g.user.username),
-        tags=OUR_ALLOWED_TAGS,
+    content = global_render_cache.clean(
+        global_repository.load_user_content(username=g.user.username)
     )
 
     return render_template(
@@ -243,13 +616,99 @@ def logout():
     return redirect(url_for("index"))
 
 
+def _format_post_cursor(cursor: PostCursor) -> str:
+    timestamp, post_id = cursor
+    return f"{timestamp.isoformat()},{post_id}"
+
+
+def _parse_post_cursor(raw_cursor: str) -> PostCursor:
+    # raises ValueError for anything that isn't "<timestamp>,<post id>"
+    raw_timestamp, separator, post_id = raw_cursor.partition(",")
+    if not separator or not post_id:
+        raise ValueError(f"malformed cursor {raw_cursor!r}")
+
+    timestamp = datetime.fromisoformat(raw_timestamp)
+    if timestamp.tzinfo is not None:
+        # post timestamps are naive utc
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp, PostID(post_id)
+
+
 @app.route("/posts")
 @requires_logged_in_user
 def list_posts():
-    posts = global_repository.load_all_top_level_posts()
-    posts.sort(key=lambda p: p.timestamp)
+    # "created" lists threads by when they were started, "activity" by their
+    # newest reply
+    order = request.args.get("order", "created")
+    if order not in ("created", "activity"):
+        abort(400)
+
+    try:
+        raw_before = request.args.get("before")
+        before = _parse_post_cursor(raw_before) if raw_before else None
+        limit = min(
+            max(int(request.args.get("limit", POSTS_PAGE_SIZE)), 1),
+            MAX_POSTS_PAGE_SIZE,
+        )
+    except ValueError:
+        abort(400)
 
-    return render_template("posts.html", posts=posts)
+    if order == "activity":
+        posts, next_cursor = global_repository.load_active_threads_page(
+            before=before, limit=limit
+        )
+    else:
+        posts, next_cursor = global_repository.load_top_level_posts_page(
+            before=before, limit=limit
+        )
+
+    summaries = {
+        post.id: global_repository.post_graph.thread_summary(post.id) for post in posts
+    }
+
+    # with the newest post in each thread, so that Last-Modified moves with
+    # replies as well as the ETag does
+    version = global_repository.content_version(
+        post_ids=[post.id for post in posts]
+        + [
+            summary.high_water_mark[1]
+            for summary in summaries.values()
+            if summary is not None
+        ]
+    )
+    etag = _page_etag(
+        version,
+        next_cursor,
+        [
+            (summary.reply_count, summary.high_water_mark, sorted(summary.participants))
+            for summary in summaries.values()
+            if summary is not None
+        ],
+    )
+    if not_modified := _not_modified(etag=etag, version=version):
+        return not_modified
+
+    return _with_validators(
+        render_template(
+            "posts.html",
+            posts=posts,
+            summaries=summaries,
+            order=order,
+            is_first_page=before is None,
+            older_posts_url=(
+                url_for(
+                    "list_posts",
+                    order=order,
+                    before=_format_post_cursor(next_cursor),
+                    limit=limit,
+                )
+                if next_cursor
+                else None
+            ),
+        ),
+        etag=etag,
+        version=version,
+    )
 
 
 @app.route("/posts/<post_id>", methods=["GET", "POST"])
@@ -257,12 +716,23 @@ def list_posts():
 def post_list(post_id: PostID):
     error = None
 
+    resolved_post_id = global_repository.resolve_post_id(post_id=post_id)
+    if resolved_post_id != post_id:
+        return redirect(url_for("post_list", post_id=resolved_post_id), code=301)
+
     posts = global_repository.load_posts(top_post_id=post_id)
 
+    if request.method == "GET":
+        version = global_repository.content_version(
+            post_ids=[post.id for post in posts]
+        )
+        etag = _page_etag(version)
+        if not_modified := _not_modified(etag=etag, version=version):
+            return not_modified
+
     post_contents = {
-        post.id: clean(
-            markdown(global_repository.load_post_content(post_id=post.id)),
-            tags=OUR_ALLOWED_TAGS,
+        post.id: global_render_cache.render_markdown(
+            global_repository.load_post_content(post_id=post.id)
         )
         for post in posts
     }
@@ -295,16 +765,68 @@ def post_list(post_id: PostID):
         except Exception as e:
             error = str(e)
 
-    return render_template(
+    page = render_template(
         "post.html",
         posts=posts,
         post_contents=post_contents,
-        tail_context=",".join(calculate_tail_context(posts)),
+        tail_context=",".join(
+            global_repository.post_graph.calculate_tail_context(
+                post.id for post in posts
+            )
+        ),
         new_title=new_title,
         new_content=new_content,
         error=error,
     )
 
+    if request.method == "GET":
+        return _with_validators(page, etag=etag, version=version)
+
+    return page
+
+
+@app.route("/search")
+@requires_logged_in_user
+def search():
+    query = request.args.get("q", "")
+
+    posts, users = global_repository.search(query=query, limit=SEARCH_RESULTS_LIMIT)
+
+    return render_template(
+        "search.html",
+        query=query,
+        posts=posts,
+        thread_roots={
+            post.id: global_repository.post_graph.thread_root(post.id) or post.id
+            for post in posts
+        },
+        users=users,
+    )
+
+
+@app.route("/chat")
+@requires_logged_in_user
+def chat():
+    room = request.args.get("room")
+    if room:
+        return redirect(url_for("chat_room", room=room))
+
+    return render_template("chat.html")
+
+
+@app.route("/chat/<room>")
+@requires_logged_in_user
+def chat_room(room: str):
+    # village.chat brings in asyncio for the chat server, which nothing else
+    # here needs
+    from village.chat import ROOM_NAME_PATTERN
+
+    if not ROOM_NAME_PATTERN.match(room):
+        abort(404)
+
+    # messages are sent and streamed by the separate chat-server process
+    return render_template("chat_room.html", room=room)
+
 
 @app.route("/posts/new", methods=["GET", "POST"])
 @requires_logged_in_user
@@ -344,3 +866,7 @@ def new_post():
         content=content,
         error=error,
     )
+
+
+# last, so that it doesn't compete with the rest of the import
+global_warm_up.start()
@@ -0,0 +1,254 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+from datetime import datetime, timezone
+from typing import IO, Iterator, NamedTuple, Optional
+
+# everything but cache/, which the server rebuilds on its own
+EXCLUDED_DIRECTORIES = {"cache"}
+
+MANIFEST_VERSION = 1
+MANIFEST_MEMBER = "MANIFEST.jsonl"
+CHUNK_BYTES = 1024 * 1024
+
+
+class BackupException(Exception):
+    pass
+
+
+class ManifestEntry(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    # the archive holding this version of the file; unchanged files point
+    # back to the archive of an earlier export
+    archive: str
+
+
+class Manifest(NamedTuple):
+    archive: str
+    created_at: str
+    previous_archive: Optional[str]
+    entries: dict[str, ManifestEntry]
+
+
+# A manifest is JSON Lines: a header, then one line per file in the
+# repository at the time of the export. It is written line by line as the
+# export goes, and a copy is the last member of the archive.
+
+
+def read_manifest(f: IO[str]) -> Manifest:
+    header = json.loads(f.readline())
+    if header.get("manifest") != MANIFEST_VERSION:
+        raise BackupException("not a backup manifest, or an unknown version")
+
+    entries = {}
+    for line in f:
+        entry = ManifestEntry(**json.loads(line))
+        entries[entry.path] = entry
+
+    return Manifest(
+        archive=header["archive"],
+        created_at=header["created_at"],
+        previous_archive=header.get("previous_archive"),
+        entries=entries,
+    )
+
+
+def load_manifest(path: str) -> Manifest:
+    with open(path, "rt", encoding="utf-8") as f:
+        return read_manifest(f)
+
+
+class _HashingReader:
+    # hashes what tarfile reads through it, so that each file is read once
+    def __init__(self, f: IO[bytes]) -> None:
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class ExportStats(NamedTuple):
+    files: int
+    changed_files: int
+    changed_bytes: int
+
+
+def export_repository(
+    *,
+    repository_path: str,
+    output: IO[bytes],
+    archive_name: str,
+    manifest_output: IO[str],
+    previous: Optional[Manifest] = None,
+    compress: bool = False,
+) -> ExportStats:
+    # streams a tar of every file whose size or mtime differs from
+    # `previous` (or of everything, without one) to `output`, and writes the
+    # new manifest to `manifest_output`. Unchanged files are only stat'ed.
+    created_at = datetime.now(timezone.utc).isoformat()
+    header = {
+        "manifest": MANIFEST_VERSION,
+        "archive": archive_name,
+        "created_at": created_at,
+        "previous_archive": previous.archive if previous else None,
+    }
+    manifest_lines = [json.dumps(header)]
+    manifest_output.write(manifest_lines[0] + "\n")
+
+    files = changed_files = changed_bytes = 0
+
+    with tarfile.open(fileobj=output, mode="w|gz" if compress else "w|") as tar:
+        for path, full_path in _repository_files(repository_path):
+            try:
+                stat = os.stat(full_path)
+            except FileNotFoundError:
+                # deleted since the directory was listed
+                continue
+
+            previous_entry = previous.entries.get(path) if previous else None
+            if (
+                previous_entry is not None
+                and previous_entry.size == stat.st_size
+                and previous_entry.mtime_ns == stat.st_mtime_ns
+            ):
+                entry = previous_entry
+            else:
+                try:
+                    entry = _add_file(
+                        tar, path=path, full_path=full_path, archive_name=archive_name
+                    )
+                except FileNotFoundError:
+                    continue
+                changed_files += 1
+                changed_bytes += entry.size
+
+            line = json.dumps(entry._asdict())
+            manifest_lines.append(line)
+            manifest_output.write(line + "\n")
+            files += 1
+
+        manifest_data = "".join(line + "\n" for line in manifest_lines).encode("utf-8")
+        tar_info = tarfile.TarInfo(name=MANIFEST_MEMBER)
+        tar_info.size = len(manifest_data)
+        tar_info.mode = 0o644
+        tar.addfile(tar_info, io.BytesIO(manifest_data))
+
+    return ExportStats(
+        files=files, changed_files=changed_files, changed_bytes=changed_bytes
+    )
+
+
+def _add_file(
+    tar: tarfile.TarFile, *, path: str, full_path: str, archive_name: str
+) -> ManifestEntry:
+    with open(full_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+
+        tar_info = tarfile.TarInfo(name=path)
+        tar_info.size = stat.st_size
+        tar_info.mtime = int(stat.st_mtime)
+        tar_info.mode = 0o644
+
+        reader = _HashingReader(f)
+        tar.addfile(tar_info, reader)  # type: ignore
+
+    return ManifestEntry(
+        path=path,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        sha256=reader.sha256.hexdigest(),
+        archive=archive_name,
+    )
+
+
+def _repository_files(repository_path: str) -> Iterator[tuple[str, str]]:
+    # (path relative to the repository, full path), in a stable order
+    for directory_path, directory_names, filenames in os.walk(repository_path):
+        if directory_path == repository_path:
+            directory_names[:] = [
+                name for name in directory_names if name not in EXCLUDED_DIRECTORIES
+            ]
+        directory_names.sort()
+
+        for filename in sorted(filenames):
+            if filename.endswith(".tmp"):
+                continue
+
+            full_path = os.path.join(directory_path, filename)
+            yield os.path.relpath(full_path, repository_path).replace(
+                os.sep, "/"
+            ), full_path
+
+
+def restore_repository(
+    *, manifest: Manifest, archives_path: str, target_path: str
+) -> int:
+    # rebuilds the repository as it was at `manifest` in an empty directory,
+    # reading each archive the manifest refers to once, start to finish
+    if os.path.exists(target_path) and os.listdir(target_path):
+        raise BackupException(f"{target_path} is not empty")
+
+    by_archive: dict[str, dict[str, ManifestEntry]] = {}
+    for entry in manifest.entries.values():
+        _safe_target(target_path, entry.path)
+        by_archive.setdefault(entry.archive, {})[entry.path] = entry
+
+    restored = 0
+    for archive_name, entries in sorted(by_archive.items()):
+        archive_path = os.path.join(archives_path, archive_name)
+        if not os.path.exists(archive_path):
+            raise BackupException(f"{archive_name} is needed but missing")
+
+        remaining = dict(entries)
+        with tarfile.open(archive_path, mode="r|*") as tar:
+            for member in tar:
+                if member.name not in remaining:
+                    continue
+                entry = remaining.pop(member.name)
+                if not member.isfile():
+                    continue
+
+                source = tar.extractfile(member)
+                assert source is not None
+                _restore_file(
+                    source, entry=entry, path=_safe_target(target_path, entry.path)
+                )
+                restored += 1
+
+        if remaining:
+            raise BackupException(
+                f"{archive_name} is missing {len(remaining)} files, "
+                f"e.g. {next(iter(remaining))}"
+            )
+
+    return restored
+
+
+def _safe_target(target_path: str, path: str) -> str:
+    full_path = os.path.abspath(os.path.join(target_path, path))
+    if not full_path.startswith(os.path.abspath(target_path) + os.sep):
+        raise BackupException(f"{path} is outside of the repository")
+    return full_path
+
+
+def _restore_file(source: IO[bytes], *, entry: ManifestEntry, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    sha256 = hashlib.sha256()
+    with open(path, "wb") as f:
+        while chunk := source.read(CHUNK_BYTES):
+            sha256.update(chunk)
+            f.write(chunk)
+
+    if sha256.hexdigest() != entry.sha256:
+        raise BackupException(f"{entry.path} does not match its hash")
+
+    os.utime(path, ns=(entry.mtime_ns, entry.mtime_ns))
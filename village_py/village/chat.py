@@ -0,0 +1,336 @@
+import asyncio
+import json
+import re
+import time
+from collections import deque
+from datetime import timedelta
+from http import HTTPStatus
+from http.cookies import CookieError, SimpleCookie
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs
+
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature
+
+from village.models.users import User, Username
+from village.repository import DoesNotExistException, Repository
+
+ROOM_NAME_PATTERN = re.compile(r"^(?!api$)[a-zA-Z0-9_-]{1,64}$")
+EVENTS_PATH_PATTERN = re.compile(r"^/chat/api/([^/]+)/events$")
+MESSAGES_PATH_PATTERN = re.compile(r"^/chat/api/([^/]+)/messages$")
+
+MAX_MESSAGE_LENGTH = 2000
+MAX_REQUEST_BODY_BYTES = 32 * 1024
+MAX_REQUEST_HEAD_BYTES = 16 * 1024
+KEEP_ALIVE_SECONDS = 15.0
+
+
+class ChatRequestException(Exception):
+    def __init__(self, status: int, reason: str) -> None:
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class ChatMessage(NamedTuple):
+    id: int
+    username: Username
+    display_name: str
+    text: str
+    timestamp: float
+    # the complete server-sent event, encoded once and shared by every client
+    event: bytes
+
+
+class ChatRoom:
+    def __init__(self, *, name: str, max_messages: int) -> None:
+        self.name = name
+        self.subscribers = 0
+        self.last_active = time.monotonic()
+
+        self._messages: deque[ChatMessage] = deque(maxlen=max_messages)
+        self._next_message_id = 1
+        # replaced on every publish; waking one event wakes every subscriber
+        self._new_message = asyncio.Event()
+
+    def publish(self, *, user: User, text: str) -> ChatMessage:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+
+        timestamp = time.time()
+        data = json.dumps(
+            {
+                "id": message_id,
+                "username": user.username,
+                "display_name": user.display_name,
+                "text": text,
+                "timestamp": timestamp,
+            }
+        )
+        message = ChatMessage(
+            id=message_id,
+            username=user.username,
+            display_name=user.display_name,
+            text=text,
+            timestamp=timestamp,
+            event=f"id: {message_id}\nevent: message\ndata: {data}\n\n".encode("utf-8"),
+        )
+        self._messages.append(message)
+        self.last_active = time.monotonic()
+
+        new_message, self._new_message = self._new_message, asyncio.Event()
+        new_message.set()
+
+        return message
+
+    def messages_after(self, message_id: int) -> list[ChatMessage]:
+        if message_id >= self._next_message_id:
+            # the client saw a previous run of the server; start over
+            message_id = 0
+
+        if not self._messages or self._messages[-1].id <= message_id:
+            return []
+
+        # ids are consecutive, so the position in the buffer can be computed
+        start = max(message_id - self._messages[0].id + 1, 0)
+        return [self._messages[i] for i in range(start, len(self._messages))]
+
+    async def wait_for_message(self, *, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._new_message.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class ChatServer:
+    def __init__(
+        self,
+        *,
+        repository: Repository,
+        secret_key: bytes,
+        session_lifetime: timedelta = timedelta(days=31),
+        max_messages_per_room: int = 200,
+        max_rooms: int = 100,
+    ) -> None:
+        self._repository = repository
+        self._max_messages_per_room = max_messages_per_room
+        self._max_rooms = max_rooms
+        self._rooms: dict[str, ChatRoom] = {}
+
+        # the forum's flask session cookie, read the same way flask does
+        session_app = Flask(__name__)
+        session_app.secret_key = secret_key
+        session_app.permanent_session_lifetime = session_lifetime
+        self._session_serializer = (
+            SecureCookieSessionInterface().get_signing_serializer(session_app)
+        )
+        self._session_cookie_name = session_app.config["SESSION_COOKIE_NAME"]
+        self._session_max_age = int(session_lifetime.total_seconds())
+
+        self.connected_clients = 0
+
+    async def serve(self, *, host: str, port: int) -> None:
+        server = await asyncio.start_server(
+            self._handle_connection, host=host, port=port, limit=MAX_REQUEST_HEAD_BYTES
+        )
+        async with server:
+            await server.serve_forever()
+
+    def room(self, name: str) -> ChatRoom:
+        room = self._rooms.get(name)
+        if room is None:
+            if len(self._rooms) >= self._max_rooms:
+                self._evict_idle_room()
+            room = self._rooms[name] = ChatRoom(
+                name=name, max_messages=self._max_messages_per_room
+            )
+        return room
+
+    def _evict_idle_room(self) -> None:
+        idle_rooms = [room for room in self._rooms.values() if not room.subscribers]
+        if not idle_rooms:
+            raise ChatRequestException(503, "too many active rooms")
+
+        oldest = min(idle_rooms, key=lambda room: room.last_active)
+        del self._rooms[oldest.name]
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            method, path, headers = await self._read_request_head(reader)
+            user = await self._authenticate(headers)
+
+            if match := EVENTS_PATH_PATTERN.match(path):
+                if method != "GET":
+                    raise ChatRequestException(405, "method not allowed")
+                await self._stream_events(
+                    writer,
+                    room=self._room_for_request(match.group(1)),
+                    last_event_id=headers.get("last-event-id", ""),
+                )
+
+            elif match := MESSAGES_PATH_PATTERN.match(path):
+                if method != "POST":
+                    raise ChatRequestException(405, "method not allowed")
+                body = await self._read_body(reader, headers)
+                self._post_message(
+                    room=self._room_for_request(match.group(1)), user=user, body=body
+                )
+                await self._write_response(writer, 204, b"")
+
+            else:
+                raise ChatRequestException(404, "not found")
+
+        except ChatRequestException as e:
+            await self._write_response(writer, e.status, e.reason.encode("utf-8"))
+
+        except (
+            ConnectionError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+        ):
+            pass
+
+        finally:
+            writer.close()
+
+    async def _read_request_head(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[str, str, dict[str, str]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise ChatRequestException(431, "request header too large")
+
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise ChatRequestException(400, "bad request line")
+
+        headers = {}
+        for line in header_lines:
+            name, separator, value = line.partition(":")
+            if separator:
+                headers[name.strip().lower()] = value.strip()
+
+        path, _, _ = target.partition("?")
+        return method, path, headers
+
+    async def _read_body(
+        self, reader: asyncio.StreamReader, headers: dict[str, str]
+    ) -> bytes:
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise ChatRequestException(400, "bad content length")
+
+        if length > MAX_REQUEST_BODY_BYTES:
+            raise ChatRequestException(413, "message too long")
+
+        return await reader.readexactly(length)
+
+    async def _authenticate(self, headers: dict[str, str]) -> User:
+        username = self._session_username(headers.get("cookie", ""))
+        if not username:
+            raise ChatRequestException(401, "not logged in")
+
+        try:
+            # a stat and maybe a small read, but keep the event loop free
+            return await asyncio.to_thread(
+                self._repository.get_user, username=Username(username)
+            )
+        except DoesNotExistException:
+            raise ChatRequestException(401, "not logged in")
+
+    def _session_username(self, cookie_header: str) -> Optional[str]:
+        try:
+            cookie = SimpleCookie(cookie_header).get(self._session_cookie_name)
+        except CookieError:
+            return None
+        if cookie is None or self._session_serializer is None:
+            return None
+
+        try:
+            session = self._session_serializer.loads(
+                cookie.value, max_age=self._session_max_age
+            )
+        except BadSignature:
+            return None
+
+        return session.get("username")
+
+    def _room_for_request(self, name: str) -> ChatRoom:
+        if not ROOM_NAME_PATTERN.match(name):
+            raise ChatRequestException(404, "no such room")
+        return self.room(name)
+
+    def _post_message(self, *, room: ChatRoom, user: User, body: bytes) -> None:
+        form = parse_qs(body.decode("utf-8", errors="replace"))
+        text = form.get("text", [""])[0].strip()
+
+        if not text:
+            raise ChatRequestException(400, "empty message")
+        if len(text) > MAX_MESSAGE_LENGTH:
+            raise ChatRequestException(413, "message too long")
+
+        room.publish(user=user, text=text)
+
+    async def _stream_events(
+        self, writer: asyncio.StreamWriter, *, room: ChatRoom, last_event_id: str
+    ) -> None:
+        last_seen = int(last_event_id) if last_event_id.isdigit() else 0
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"X-Accel-Buffering: no\r\n"
+            b"\r\n"
+            b"retry: 2000\n\n"
+        )
+
+        room.subscribers += 1
+        self.connected_clients += 1
+        try:
+            while True:
+                messages = room.messages_after(last_seen)
+                if messages:
+                    writer.write(b"".join(message.event for message in messages))
+                    last_seen = messages[-1].id
+                else:
+                    await room.wait_for_message(timeout=KEEP_ALIVE_SECONDS)
+                    if not room.messages_after(last_seen):
+                        # keeps proxies from timing out, and notices closed
+                        # connections
+                        writer.write(b": keep-alive\n\n")
+
+                await writer.drain()
+
+        finally:
+            room.subscribers -= 1
+            self.connected_clients -= 1
+
+    async def _write_response(
+        self, writer: asyncio.StreamWriter, status: int, body: bytes
+    ) -> None:
+        writer.write(
+            f"HTTP/1.1 {status} {_reason_phrase(status)}\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n"
+            f"\r\n".encode("latin-1") + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+def _reason_phrase(status: int) -> str:
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return ""
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+from typing import IO, NamedTuple
+
+from village.metrics import global_metrics
+
+CHUNK_BYTES = 1024 * 1024
+
+# decompression bomb limits, checked from the header before anything is
+# decoded: a 50 megapixel photo decodes to 150 MB, and every frame of an
+# animation is decoded in turn for its thumbnail and variants
+MAX_IMAGE_PIXELS = 50_000_000
+MAX_ANIMATION_PIXELS = 250_000_000
+
+# uploads are named after their contents, with the extension of the format
+# they actually are, whatever they were called when uploaded
+UPLOAD_EXTENSIONS = {
+    "GIF": ".gif",
+    "JPEG": ".jpg",
+    "PNG": ".png",
+}
+
+
+class UploadRejectedException(Exception):
+    pass
+
+
+class IngestedUpload(NamedTuple):
+    filename: str
+    sha256: str
+    size: int
+    width: int
+    height: int
+    # an identical file had been uploaded before, and is shared
+    duplicate: bool
+
+
+@global_metrics.timed("upload_ingest")
+def ingest_image_upload(stream: IO[bytes], *, uploads_path: str) -> IngestedUpload:
+    # copies the upload to a temporary file beside the others in chunks,
+    # hashing as it goes, checks it is an image of a sensible size, and moves
+    # it into place under its hash unless that file already exists
+    os.makedirs(uploads_path, exist_ok=True)
+    fd, temporary_path = tempfile.mkstemp(dir=uploads_path, suffix=".tmp")
+
+    try:
+        sha256 = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            while chunk := stream.read(CHUNK_BYTES):
+                sha256.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+
+        image_format, width, height = _check_image(temporary_path)
+
+        digest = sha256.hexdigest()
+        filename = digest + UPLOAD_EXTENSIONS[image_format]
+        path = os.path.join(uploads_path, filename)
+        duplicate = os.path.exists(path)
+        if duplicate:
+            os.remove(temporary_path)
+        else:
+            os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    return IngestedUpload(
+        filename=filename,
+        sha256=digest,
+        size=size,
+        width=width,
+        height=height,
+        duplicate=duplicate,
+    )
+
+
+def _check_image(path: str) -> tuple[str, int, int]:
+    # reads headers and, for GIFs, frame headers only; nothing is decoded.
+    # Pillow is imported here, on the first upload, rather than at startup
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path, formats=tuple(UPLOAD_EXTENSIONS)) as img:
+            image_format = img.format
+            width, height = img.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise UploadRejectedException(
+                    f"image is too large: {width}x{height} pixels, at most "
+                    f"{MAX_IMAGE_PIXELS // 1_000_000} megapixels are allowed"
+                )
+
+            n_frames = getattr(img, "n_frames", 1)
+            if width * height * n_frames > MAX_ANIMATION_PIXELS:
+                raise UploadRejectedException(
+                    f"animation is too large: {n_frames} frames of "
+                    f"{width}x{height} pixels"
+                )
+
+            # checksums, where the format has them
+            img.verify()
+    except UnidentifiedImageError:
+        raise UploadRejectedException("not a GIF, JPEG or PNG image")
+    except Image.DecompressionBombError:
+        raise UploadRejectedException("image is too large")
+    except (OSError, SyntaxError) as e:
+        raise UploadRejectedException(f"image is damaged: {e}")
+
+    assert image_format is not None
+    return image_format, width, height
@@ -0,0 +1,216 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple, Optional
+
+from village.metrics import global_metrics
+from village.models.jobs import JobID, ThumbnailJob
+from village.models.users import Username
+from village.repository import DoesNotExistException, Repository
+
+
+class _JobResult(NamedTuple):
+    thumbnail_seconds: float
+    variants_seconds: float
+    variant_widths: list[int]
+
+
+def _make_thumbnail_for_job(source_filename: str, filename: str) -> _JobResult:
+    # runs in a worker process, so report the times back for the parent to
+    # record; Pillow is only ever imported there
+    from village.images.thumbnails import make_and_save_thumbnail_for_file
+    from village.images.variants import make_and_save_variants_for_file
+
+    started_at = time.perf_counter()
+    make_and_save_thumbnail_for_file(source_filename, filename)
+    thumbnail_finished_at = time.perf_counter()
+    variant_widths = make_and_save_variants_for_file(source_filename)
+
+    return _JobResult(
+        thumbnail_seconds=thumbnail_finished_at - started_at,
+        variants_seconds=time.perf_counter() - thumbnail_finished_at,
+        variant_widths=variant_widths,
+    )
+
+
+class ThumbnailJobQueue:
+    def __init__(
+        self,
+        *,
+        repository: Repository,
+        max_workers: int,
+        max_attempts: int = 3,
+        retry_delay_seconds: float = 5.0,
+    ) -> None:
+        self._repository = repository
+        self._max_workers = max_workers
+        self._max_attempts = max_attempts
+        self._retry_delay_seconds = retry_delay_seconds
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # of the jobs this process is running, held until they finish
+        self._claims: dict[JobID, int] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, *, username: Username, source_filename: str) -> ThumbnailJob:
+        _, extension = os.path.splitext(source_filename)
+
+        job = ThumbnailJob(
+            id=self._repository.new_job_id(),
+            username=username,
+            source_filename=source_filename,
+            thumbnail_filename=self._repository.new_upload_filename(suffix=extension),
+            status="pending",
+            attempts=0,
+            error=None,
+        )
+        # failed jobs are kept to be reported only until the next upload
+        for old_job in self._repository.load_user_thumbnail_jobs(username=username):
+            if old_job.status == "failed":
+                self._repository.delete_thumbnail_job(job=old_job)
+
+        self._repository.save_thumbnail_job(job=job)
+
+        if self._claim(job=job):
+            self._schedule(job=job)
+
+        return job
+
+    def resume(self) -> None:
+        for job in self._repository.load_all_thumbnail_jobs():
+            if job.status == "pending" and self._claim(job=job):
+                self._schedule(job=job)
+
+    def status_for(self, *, username: Username) -> Optional[ThumbnailJob]:
+        # from the job file, so that every worker process gives the same
+        # answer whichever of them runs the job; finished jobs are removed
+        try:
+            user = self._repository.get_user(username=username)
+        except DoesNotExistException:
+            return None
+        if user.image_filename is None:
+            return None
+
+        try:
+            return self._repository.load_thumbnail_job(
+                username=username, source_filename=user.image_filename
+            )
+        except DoesNotExistException:
+            return None
+
+    def _claim(self, *, job: ThumbnailJob) -> bool:
+        claim = self._repository.claim_thumbnail_job(job=job)
+        if claim is None:
+            return False
+
+        # another process may have finished it before we got the claim
+        try:
+            current_job = self._repository.load_thumbnail_job(
+                username=job.username, source_filename=job.source_filename
+            )
+        except DoesNotExistException:
+            current_job = None
+        if current_job is None or current_job.status != "pending":
+            self._repository.release_thumbnail_job_claim(job=job, claim=claim)
+            return False
+
+        with self._lock:
+            self._claims[job.id] = claim
+        return True
+
+    def _release(self, *, job: ThumbnailJob) -> None:
+        with self._lock:
+            claim = self._claims.pop(job.id)
+        self._repository.release_thumbnail_job_claim(job=job, claim=claim)
+
+    def _schedule(self, *, job: ThumbnailJob) -> None:
+        executor = self._get_executor()
+        try:
+            future = executor.submit(
+                _make_thumbnail_for_job,
+                self._repository.upload_path_for(filename=job.source_filename),
+                self._repository.upload_path_for(filename=job.thumbnail_filename),
+            )
+        except BrokenProcessPool as e:
+            self._discard_executor(executor)
+            self._job_failed(job=job, error=e)
+            return
+
+        future.add_done_callback(
+            lambda f: self._job_finished(job=job, executor=executor, future=f)
+        )
+
+    def _job_finished(
+        self, *, job: ThumbnailJob, executor: ProcessPoolExecutor, future: Future
+    ) -> None:
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._discard_executor(executor)
+
+        if error is not None:
+            self._job_failed(job=job, error=error)
+            return
+
+        result: _JobResult = future.result()
+        global_metrics.observe_phase(
+            phase="thumbnail", seconds=result.thumbnail_seconds
+        )
+        global_metrics.observe_phase(
+            phase="image_variants", seconds=result.variants_seconds
+        )
+
+        try:
+            try:
+                user = self._repository.get_user(username=job.username)
+            except DoesNotExistException:
+                user = None
+
+            if user is not None and user.image_filename == job.source_filename:
+                user.image_thumbnail = job.thumbnail_filename
+                user.image_variant_widths = result.variant_widths
+                self._repository.update_user(user=user)
+
+            job.status = "done"
+            self._repository.delete_thumbnail_job(job=job)
+        finally:
+            # left pending if that failed, for the next resume() to run again
+            self._release(job=job)
+
+    def _job_failed(self, *, job: ThumbnailJob, error: BaseException) -> None:
+        job.attempts += 1
+        job.error = repr(error)
+
+        if job.attempts >= self._max_attempts:
+            job.status = "failed"
+            try:
+                self._repository.save_thumbnail_job(job=job)
+            finally:
+                self._release(job=job)
+            return
+
+        self._repository.save_thumbnail_job(job=job)
+
+        retry = threading.Timer(
+            self._retry_delay_seconds * job.attempts,
+            lambda: self._schedule(job=job),
+        )
+        retry.daemon = True
+        retry.start()
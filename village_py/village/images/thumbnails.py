@@ -1,15 +1,36 @@
-from typing import Optional
-from PIL.Image import Image, Resampling
-from PIL.ImageOps import exif_transpose
+import os
+from typing import Iterator, Optional
+from PIL.Image import Image, Resampling, Transpose, open as open_image
+
+from village.metrics import global_metrics
 
 THUMBNAIL_SIZE = (64, 64)
+MAX_EXTRA_FRAMES = 1000
+
+# shrink with Image.reduce until within this factor of the target, then resample
+REDUCING_GAP = 2.0
+
+_EXIF_ORIENTATION = 0x0112
+_ORIENTATION_TRANSPOSITIONS = {
+    2: Transpose.FLIP_LEFT_RIGHT,
+    3: Transpose.ROTATE_180,
+    4: Transpose.FLIP_TOP_BOTTOM,
+    5: Transpose.TRANSPOSE,
+    6: Transpose.ROTATE_270,
+    7: Transpose.TRANSVERSE,
+    8: Transpose.ROTATE_90,
+}
 
 
+@global_metrics.timed("thumbnail")
 def make_and_save_thumbnail(img: Image, filename: str) -> None:
-    thumbnail, extra_frames = make_thumbnail(img)
+    frames = iter_thumbnail_frames(img)
+    thumbnail = next(frames)
 
     with open(filename, "wb") as f:
-        if extra_frames:
+        if getattr(img, "n_frames", 1) > 1:
+            # the GIF writer walks append_images once, others walk it twice
+            extra_frames = frames if img.format == "GIF" else list(frames)
             thumbnail.save(
                 f, format=img.format, save_all=True, append_images=extra_frames
             )
@@ -17,60 +38,76 @@ def make_and_save_thumbnail(img: Image, filename: str) -> None:
             thumbnail.save(f, format=img.format)
 
 
-def make_thumbnail(img: Image) -> tuple[Image, Optional[list[Image]]]:
-    if not hasattr(img, "n_frames"):
-        return _make_simple_thumbnail(img), None
+def make_and_save_thumbnail_for_file(source_filename: str, filename: str) -> None:
+    temporary_filename = filename + ".tmp"
 
-    else:
-        return _make_multiframe_thumbnail(img)
+    with open_image(source_filename) as img:
+        make_and_save_thumbnail(img, temporary_filename)
 
+    os.replace(temporary_filename, filename)
 
-def _make_simple_thumbnail(img: Image) -> Image:
-    thumbnail = exif_transpose(img, in_place=False)
-    assert thumbnail
 
-    square_dim = min(thumbnail.width, thumbnail.height)
-    if thumbnail.width == square_dim and thumbnail.height == square_dim:
-        left, right, top, bottom = 0, thumbnail.width, 0, thumbnail.height
+def make_thumbnail(img: Image) -> tuple[Image, Optional[list[Image]]]:
+    frames = iter_thumbnail_frames(img)
+    thumbnail = next(frames)
 
-    elif thumbnail.width == square_dim:
-        left, right = 0, thumbnail.width
+    if not hasattr(img, "n_frames"):
+        return thumbnail, None
 
-        extra = thumbnail.height - square_dim
-        assert extra > 0
-        half_extra = int(extra / 2)
+    return thumbnail, list(frames)
 
-        top, bottom = half_extra, thumbnail.height - extra + half_extra
 
-    elif thumbnail.height == square_dim:
-        top, bottom = 0, thumbnail.height
+def iter_thumbnail_frames(img: Image) -> Iterator[Image]:
+    request_reduced_decoding(img, side=min(THUMBNAIL_SIZE))
 
-        extra = thumbnail.width - square_dim
-        assert extra > 0
-        half_extra = int(extra / 2)
+    box = _square_crop_box(img.width, img.height)
+    side = min(THUMBNAIL_SIZE[0], box[2] - box[0])
+    transposition = orientation_transposition(img)
 
-        left, right = half_extra, thumbnail.width - extra + half_extra
+    def thumbnail_for_current_frame() -> Image:
+        thumbnail = img.resize(
+            (side, side),
+            resample=Resampling.LANCZOS,
+            box=box,
+            reducing_gap=REDUCING_GAP,
+        )
+        if transposition is not None:
+            thumbnail = thumbnail.transpose(transposition)
+        return thumbnail
 
-    else:
-        raise Exception("but how?")
+    yield thumbnail_for_current_frame()
 
-    thumbnail = thumbnail.crop((left, top, right, bottom))
+    n_frames = getattr(img, "n_frames", 1)
+    for frame in range(1, min(n_frames, MAX_EXTRA_FRAMES + 2)):
+        img.seek(frame)
+        yield thumbnail_for_current_frame()
 
-    thumbnail.thumbnail(THUMBNAIL_SIZE, resample=Resampling.LANCZOS)
 
-    return thumbnail
+def orientation_transposition(img: Image) -> Optional[Transpose]:
+    orientation = img.getexif().get(_EXIF_ORIENTATION)
+    if not isinstance(orientation, int):
+        return None
+    return _ORIENTATION_TRANSPOSITIONS.get(orientation)
 
 
-def _make_multiframe_thumbnail(img: Image) -> tuple[Image, list[Image]]:
-    thumbnail = _make_simple_thumbnail(img)
+def request_reduced_decoding(img: Image, *, side: int) -> None:
+    # decode at no less than `side` (times the reducing gap) along the shorter
+    # dimension; only has an effect on JPEGs that have not been loaded yet
+    square_dim = min(img.width, img.height)
+    scale = square_dim / (side * REDUCING_GAP)
+    if scale > 1:
+        img.draft(img.mode, (int(img.width / scale) + 1, int(img.height / scale) + 1))
 
-    extra_frames = []
-    assert hasattr(img, "n_frames")
-    for frame in range(1, img.n_frames):
-        img.seek(frame)
-        extra_frames.append(_make_simple_thumbnail(img))
 
-        if len(extra_frames) > 1000:
-            break
+def _square_crop_box(width: int, height: int) -> tuple[int, int, int, int]:
+    square_dim = min(width, height)
+
+    half_extra_width = int((width - square_dim) / 2)
+    half_extra_height = int((height - square_dim) / 2)
 
-    return thumbnail, extra_frames
+    return (
+        half_extra_width,
+        half_extra_height,
+        half_extra_width + square_dim,
+        half_extra_height + square_dim,
+    )
@@ -0,0 +1,27 @@
+import os
+
+# the widths images are scaled down to; an image narrower than one of these
+# gets a variant at its own width in that one's place instead
+VARIANT_SIZES = (64, 256, 1024)
+
+# formats offered, in order of preference, to clients that accept them, on
+# top of the original's, where Pillow can write them; animated images only
+# get the original's
+NEGOTIATED_FORMATS = (
+    ("AVIF", "avif", "image/avif"),
+    ("WEBP", "webp", "image/webp"),
+)
+
+
+def variant_filename(filename: str, *, size: int, extension: str) -> str:
+    # e.g. "<name>.256.webp" for "<name>.jpg"
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}.{size}.{extension}"
+
+
+def variant_size_for_width(width: int) -> int:
+    # the size a variant of this width is filed under
+    for size in VARIANT_SIZES:
+        if width <= size:
+            return size
+    return VARIANT_SIZES[-1]
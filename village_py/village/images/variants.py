@@ -0,0 +1,161 @@
+import os
+import threading
+from typing import Iterator, Optional
+
+from PIL import Image as PILImage
+from PIL.Image import Image, Resampling, Transpose
+
+from village.images.thumbnails import (
+    MAX_EXTRA_FRAMES,
+    REDUCING_GAP,
+    orientation_transposition,
+    request_reduced_decoding,
+)
+from village.images.variant_files import (
+    NEGOTIATED_FORMATS,
+    VARIANT_SIZES,
+    variant_filename,
+    variant_size_for_width,
+)
+from village.metrics import global_metrics
+
+# the formats this Pillow has writers for; features.check() doesn't know
+# every format on older versions, e.g. "avif" before 11.2
+PILImage.init()
+ALTERNATE_FORMATS = [
+    (image_format, extension)
+    for image_format, extension, _ in NEGOTIATED_FORMATS
+    if image_format in PILImage.SAVE
+]
+
+_SAVE_OPTIONS: dict[str, dict] = {
+    "JPEG": {"quality": 85, "optimize": True},
+    "WEBP": {"quality": 80},
+    "AVIF": {"quality": 60},
+}
+
+_AXES_SWAPPING_TRANSPOSITIONS = {
+    Transpose.ROTATE_90,
+    Transpose.ROTATE_270,
+    Transpose.TRANSPOSE,
+    Transpose.TRANSVERSE,
+}
+
+
+def make_and_save_variants_for_file(source_filename: str) -> list[int]:
+    with PILImage.open(source_filename) as img:
+        return make_and_save_variants(img, source_filename)
+
+
+@global_metrics.timed("image_variants")
+def make_and_save_variants(img: Image, source_filename: str) -> list[int]:
+    # writes the variants beside the source and returns their widths
+    request_reduced_decoding(img, side=VARIANT_SIZES[-1])
+
+    transposition = orientation_transposition(img)
+    if transposition in _AXES_SWAPPING_TRANSPOSITIONS:
+        display_width, display_height = img.height, img.width
+    else:
+        display_width, display_height = img.width, img.height
+
+    animated = getattr(img, "n_frames", 1) > 1
+    source_extension = os.path.splitext(source_filename)[1]
+    # images not read from a file have no format of their own
+    source_format = img.format or PILImage.registered_extensions().get(
+        source_extension.lower()
+    )
+    if source_format is None:
+        raise ValueError(f"no image format for {source_filename}")
+    image_formats = [(source_format, source_extension[1:])]
+    if not animated:
+        image_formats += ALTERNATE_FORMATS
+
+    widths = sorted({min(size, display_width) for size in VARIANT_SIZES})
+    for width in widths:
+        height = max(1, round(display_height * width / display_width))
+        # a still image is resized once for all of its formats; the frames of
+        # an animated one are resized as they are written, as for thumbnails
+        still_frame = None
+        if not animated:
+            still_frame = next(
+                _iter_variant_frames(
+                    img, width=width, height=height, transposition=transposition
+                )
+            )
+
+        for image_format, extension in image_formats:
+            if still_frame is None:
+                frames = _iter_variant_frames(
+                    img, width=width, height=height, transposition=transposition
+                )
+                first_frame = next(frames)
+            else:
+                first_frame, frames = still_frame, iter(())
+
+            _save_frames(
+                first_frame,
+                frames,
+                filename=variant_filename(
+                    source_filename,
+                    size=variant_size_for_width(width),
+                    extension=extension,
+                ),
+                image_format=image_format,
+                animated=animated,
+            )
+
+    return widths
+
+
+def _iter_variant_frames(
+    img: Image, *, width: int, height: int, transposition: Optional[Transpose]
+) -> Iterator[Image]:
+    if transposition in _AXES_SWAPPING_TRANSPOSITIONS:
+        size = (height, width)
+    else:
+        size = (width, height)
+
+    n_frames = getattr(img, "n_frames", 1)
+    for frame in range(min(n_frames, MAX_EXTRA_FRAMES + 1)):
+        img.seek(frame)
+        variant = img.resize(
+            size, resample=Resampling.LANCZOS, reducing_gap=REDUCING_GAP
+        )
+        if transposition is not None:
+            variant = variant.transpose(transposition)
+        yield variant
+
+
+def _save_frames(
+    first_frame: Image,
+    extra_frames: Iterator[Image],
+    *,
+    filename: str,
+    image_format: str,
+    animated: bool,
+) -> None:
+    # uploads are shared, so two jobs may be writing the same variant at once
+    temporary_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        with open(temporary_filename, "wb") as f:
+            options = _SAVE_OPTIONS.get(image_format, {})
+            if animated:
+                # the GIF writer walks append_images once, others walk it twice
+                first_frame.save(
+                    f,
+                    format=image_format,
+                    save_all=True,
+                    append_images=(
+                        extra_frames if image_format == "GIF" else list(extra_frames)
+                    ),
+                    **options,
+                )
+            else:
+                first_frame.save(f, format=image_format, **options)
+
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
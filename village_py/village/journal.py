@@ -0,0 +1,104 @@
+import os
+import threading
+from typing import Iterable, Optional
+
+from village.snapshot import SnapshotKind
+
+# once the journal grows past this, the next writer starts a fresh one
+MAX_JOURNAL_BYTES = 1024 * 1024
+
+
+# An append-only log of changed keys, shared by every process using a
+# repository. Each line is "<kind>\t<key>\n", written with a single O_APPEND
+# write so that concurrent writers never interleave.
+#
+# Readers remember how far they have read, so checking for changes costs one
+# fstat when nothing happened. When the journal is replaced (after growing too
+# large, or if it was deleted) a reader cannot know what it missed, and
+# read_changes returns None to ask for a full rescan.
+class ChangeJournal:
+    def __init__(self, *, path: str, max_bytes: int = MAX_JOURNAL_BYTES) -> None:
+        self._path = path
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        # kind -> (inode, offset) of the journal as last read
+        self._positions: dict[SnapshotKind, tuple[Optional[int], int]] = {}
+
+    def record(self, *, kind: SnapshotKind, keys: Iterable[str]) -> None:
+        data = "".join(f"{kind}\t{key}\n" for key in keys).encode("utf-8")
+        if not data:
+            return
+
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+        fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+        if size > self._max_bytes:
+            self._start_new_journal()
+
+    def _start_new_journal(self) -> None:
+        temporary_path = f"{self._path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb"):
+            pass
+        os.replace(temporary_path, self._path)
+
+    def mark_read(self, *, kind: SnapshotKind) -> None:
+        # skip everything written so far; call before a full rescan
+        with self._lock:
+            self._positions[kind] = self._current_position()
+
+    def read_changes(self, *, kind: SnapshotKind) -> Optional[set[str]]:
+        with self._lock:
+            position = self._positions.get(kind)
+            if position is None:
+                return None
+
+            inode, offset = position
+            if self._current_position() == position:
+                return set()
+
+            try:
+                f = open(self._path, "rb")
+            except FileNotFoundError:
+                return set() if inode is None else None
+
+            with f:
+                stat = os.fstat(f.fileno())
+                if inode is None:
+                    # there was no journal when we last looked; it is all new
+                    inode = stat.st_ino
+
+                if stat.st_ino != inode or stat.st_size < offset:
+                    return None
+
+                if stat.st_size == offset:
+                    self._positions[kind] = (inode, offset)
+                    return set()
+
+                f.seek(offset)
+                data = f.read(stat.st_size - offset)
+
+            # a writer may be partway through a line; leave it for next time
+            complete = data[: data.rfind(b"\n") + 1]
+            self._positions[kind] = (inode, offset + len(complete))
+
+        prefix = kind + "\t"
+        return {
+            line[len(prefix) :]
+            for line in complete.decode("utf-8").splitlines()
+            if line.startswith(prefix)
+        }
+
+    def _current_position(self) -> tuple[Optional[int], int]:
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return None, 0
+
+        return stat.st_ino, stat.st_size
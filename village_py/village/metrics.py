@@ -0,0 +1,214 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Callable, Iterable, Iterator, Literal, NamedTuple, Optional
+
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# phases that run outside of any request, e.g. in the thumbnail job queue
+BACKGROUND_ROUTE = "background"
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Sample(NamedTuple):
+    name: str
+    kind: Literal["counter"] | Literal["gauge"]
+    help: str
+    value: float
+    labels: Labels = ()
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+@dataclass
+class RequestTimings:
+    route: str
+    phases: dict[str, float] = field(default_factory=dict)
+
+
+_current_request: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "village_current_request", default=None
+)
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._request_histograms: dict[Labels, Histogram] = {}
+        self._phase_histograms: dict[Labels, Histogram] = {}
+        self._collectors: list[Callable[[], Iterable[Sample]]] = []
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def start_request(self, *, route: str) -> RequestTimings:
+        timings = RequestTimings(route=route)
+        _current_request.set(timings)
+        return timings
+
+    def finish_request(
+        self, *, timings: RequestTimings, method: str, status: int, seconds: float
+    ) -> None:
+        _current_request.set(None)
+
+        labels = (
+            ("route", timings.route),
+            ("method", method),
+            ("status", str(status)),
+        )
+        with self._lock:
+            self._histogram(self._request_histograms, labels).observe(seconds)
+
+    def observe_phase(self, *, phase: str, seconds: float) -> None:
+        timings = _current_request.get()
+        if timings is not None:
+            timings.phases[phase] = timings.phases.get(phase, 0.0) + seconds
+            route = timings.route
+        else:
+            route = BACKGROUND_ROUTE
+
+        labels = (("route", route), ("phase", phase))
+        with self._lock:
+            self._histogram(self._phase_histograms, labels).observe(seconds)
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase=phase, seconds=time.perf_counter() - started_at)
+
+    def timed(self, phase: str):
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.phase(phase):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _histogram(
+        self, histograms: dict[Labels, Histogram], labels: Labels
+    ) -> Histogram:
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = Histogram()
+        return histogram
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+
+        with self._lock:
+            self._render_histograms(
+                lines,
+                name="village_request_duration_seconds",
+                help="Time spent handling requests, by route.",
+                histograms=self._request_histograms,
+            )
+            self._render_histograms(
+                lines,
+                name="village_phase_duration_seconds",
+                help="Time spent in each phase of handling requests, by route.",
+                histograms=self._phase_histograms,
+            )
+
+        described: set[str] = set()
+        for collector in self._collectors:
+            for sample in collector():
+                if sample.name not in described:
+                    lines.append(f"# HELP {sample.name} {sample.help}")
+                    lines.append(f"# TYPE {sample.name} {sample.kind}")
+                    described.add(sample.name)
+                lines.append(
+                    f"{sample.name}{_format_labels(sample.labels)} {sample.value}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def _render_histograms(
+        self,
+        lines: list[str],
+        *,
+        name: str,
+        help: str,
+        histograms: dict[Labels, Histogram],
+    ) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+
+        for labels, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bucket, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                bucket_labels = labels + (("le", repr(bucket)),)
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(
+                f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} "
+                f"{histogram.count}"
+            )
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+
+def format_server_timing(timings: RequestTimings, *, total_seconds: float) -> str:
+    entries = [
+        f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timings.phases.items()
+    ]
+    entries.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    return (
+        "{"
+        + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels)
+        + "}"
+    )
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+global_metrics = Metrics()
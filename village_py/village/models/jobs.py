@@ -0,0 +1,17 @@
+from typing import Literal, NewType
+
+from pydantic import BaseModel
+
+from village.models.users import Username
+
+JobID = NewType("JobID", str)
+
+
+class ThumbnailJob(BaseModel):
+    id: JobID
+    username: Username
+    source_filename: str
+    thumbnail_filename: str
+    status: Literal["pending"] | Literal["done"] | Literal["failed"]
+    attempts: int
+    error: str | None
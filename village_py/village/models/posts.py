@@ -1,9 +1,11 @@
-from typing import NewType
-from datetime import datetime
+import hashlib
+import os
+import uuid
+from typing import NewType, Optional
+from datetime import datetime, timezone
 from village.models.users import Username
 from pydantic import BaseModel
 
-
 PostID = NewType("PostID", str)
 
 
@@ -14,3 +16,48 @@ class Post(BaseModel):
     title: str
     context: list[PostID]
     upload_filename: str | None
+
+
+def new_time_ordered_post_id(
+    timestamp: datetime, *, source_key: Optional[str] = None
+) -> PostID:
+    # a UUIDv7: 48 bits of unix milliseconds, then the version, variant and
+    # random bits, so that ids sort (and shard) by when the post was written.
+    # With a source key, like the Message-ID of an imported post, the other
+    # bits come from its hash instead, so the same post always gets the same id
+    unix_ms = int(_as_utc(timestamp).timestamp() * 1000)
+    if source_key is None:
+        random_bits = int.from_bytes(os.urandom(10), "big")
+    else:
+        random_bits = int.from_bytes(
+            hashlib.sha256(source_key.encode("utf-8")).digest()[:10], "big"
+        )
+
+    value = (unix_ms & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= ((random_bits >> 62) & 0xFFF) << 64
+    value |= 0b10 << 62
+    value |= random_bits & ((1 << 62) - 1)
+
+    return PostID(str(uuid.UUID(int=value)))
+
+
+def post_id_timestamp(post_id: PostID) -> Optional[datetime]:
+    # None for ids that don't carry a time, like the uuid4s of older posts
+    try:
+        value = uuid.UUID(post_id)
+    except ValueError:
+        return None
+
+    if value.version != 7:
+        return None
+
+    return datetime.fromtimestamp((value.int >> 80) / 1000, tz=timezone.utc)
+
+
+def _as_utc(timestamp: datetime) -> datetime:
+    # post timestamps are naive utc
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+
+    return timestamp.astimezone(timezone.utc)
@@ -1,9 +1,15 @@
-import hashlib
 import os
 from typing import NewType, Optional
 
 from pydantic import BaseModel, Field
 
+from village.passwords import (
+    CURRENT_SCRYPT_PARAMETERS,
+    LEGACY_SCRYPT_PARAMETERS,
+    ScryptParameters,
+    global_password_hasher,
+)
+
 Username = NewType("Username", str)
 
 
@@ -12,9 +18,14 @@ class User(BaseModel):
     display_name: str
     password_salt: bytes = Field(repr=False)
     encrypted_password: bytes = Field(repr=False)
+    scrypt_n: int = LEGACY_SCRYPT_PARAMETERS.n
+    scrypt_r: int = LEGACY_SCRYPT_PARAMETERS.r
+    scrypt_p: int = LEGACY_SCRYPT_PARAMETERS.p
     new_password_required: bool
     image_filename: str | None
     image_thumbnail: str | None
+    # the widths of the scaled-down variants of image_filename, once made
+    image_variant_widths: list[int] = []
 
     @classmethod
     def create_new_user(
@@ -22,7 +33,9 @@ class User(BaseModel):
     ) -> "User":
         password_salt = cls._generate_salt()
         encrypted_password = cls._encrypt_password(
-            password=password, salt=password_salt
+            password=password,
+            salt=password_salt,
+            parameters=CURRENT_SCRYPT_PARAMETERS,
         )
 
         return User(
@@ -30,20 +43,36 @@ class User(BaseModel):
             display_name=display_name,
             password_salt=password_salt,
             encrypted_password=encrypted_password,
+            scrypt_n=CURRENT_SCRYPT_PARAMETERS.n,
+            scrypt_r=CURRENT_SCRYPT_PARAMETERS.r,
+            scrypt_p=CURRENT_SCRYPT_PARAMETERS.p,
             new_password_required=True,
             image_filename=None,
             image_thumbnail=None,
         )
 
+    @property
+    def scrypt_parameters(self) -> ScryptParameters:
+        return ScryptParameters(n=self.scrypt_n, r=self.scrypt_r, p=self.scrypt_p)
+
     def check_password(self, *, password: str) -> bool:
         return (
             self._encrypt_password(
                 password=password,
                 salt=self.password_salt,
+                parameters=self.scrypt_parameters,
             )
             == self.encrypted_password
         )
 
+    def password_needs_rehash(self) -> bool:
+        return self.scrypt_parameters != CURRENT_SCRYPT_PARAMETERS
+
+    def rehash_password(self, *, password: str):
+        # only after check_password has accepted the password, as at login;
+        # checking again here would cost another scrypt run
+        self._force_update_password(new_password=password)
+
     def update_password(self, *, current_password: str, new_password: str):
         assert self.check_password(password=current_password)
 
@@ -53,19 +82,18 @@ class User(BaseModel):
         self.encrypted_password = self._encrypt_password(
             password=new_password,
             salt=self.password_salt,
+            parameters=CURRENT_SCRYPT_PARAMETERS,
         )
+        self.scrypt_n, self.scrypt_r, self.scrypt_p = CURRENT_SCRYPT_PARAMETERS
 
     @classmethod
     def _generate_salt(cls) -> bytes:
         return os.urandom(64)
 
     @classmethod
-    def _encrypt_password(cls, *, password: str, salt: bytes) -> bytes:
-        return hashlib.scrypt(
-            password.encode("utf-8"),
-            salt=salt,
-            n=16384,
-            r=8,
-            p=1,
-            dklen=32,
+    def _encrypt_password(
+        cls, *, password: str, salt: bytes, parameters: ScryptParameters
+    ) -> bytes:
+        return global_password_hasher.hash(
+            password=password, salt=salt, parameters=parameters
         )
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import NamedTuple
+
+from village.metrics import global_metrics
+
+
+class ScryptParameters(NamedTuple):
+    n: int
+    r: int
+    p: int
+
+    @property
+    def maxmem(self) -> int:
+        return 128 * self.r * (self.n + self.p + 2) + 1024 * 1024
+
+
+LEGACY_SCRYPT_PARAMETERS = ScryptParameters(n=16384, r=8, p=1)
+
+CURRENT_SCRYPT_PARAMETERS = ScryptParameters(
+    n=int(os.environ.get("VILLAGE_SCRYPT_N", LEGACY_SCRYPT_PARAMETERS.n)),
+    r=int(os.environ.get("VILLAGE_SCRYPT_R", LEGACY_SCRYPT_PARAMETERS.r)),
+    p=int(os.environ.get("VILLAGE_SCRYPT_P", LEGACY_SCRYPT_PARAMETERS.p)),
+)
+
+
+class PasswordHasherSaturatedException(Exception):
+    pass
+
+
+@dataclass
+class PasswordHasherStats:
+    in_flight: int = 0
+    completed: int = 0
+    rejected: int = 0
+    queue_wait_seconds_total: float = 0.0
+    queue_wait_seconds_max: float = 0.0
+    hash_seconds_total: float = 0.0
+    hash_seconds_max: float = 0.0
+
+
+class PasswordHasher:
+    def __init__(self, *, max_workers: int, max_queued: int) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="scrypt"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._stats_lock = threading.Lock()
+
+        self.stats = PasswordHasherStats()
+
+    def hash(
+        self, *, password: str, salt: bytes, parameters: ScryptParameters
+    ) -> bytes:
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.stats.rejected += 1
+            raise PasswordHasherSaturatedException("too many password checks in flight")
+
+        with self._stats_lock:
+            self.stats.in_flight += 1
+
+        try:
+            with global_metrics.phase("scrypt"):
+                return self._executor.submit(
+                    self._timed_scrypt,
+                    password=password,
+                    salt=salt,
+                    parameters=parameters,
+                    submitted_at=time.perf_counter(),
+                ).result()
+
+        finally:
+            with self._stats_lock:
+                self.stats.in_flight -= 1
+            self._slots.release()
+
+    def _timed_scrypt(
+        self,
+        *,
+        password: str,
+        salt: bytes,
+        parameters: ScryptParameters,
+        submitted_at: float,
+    ) -> bytes:
+        started_at = time.perf_counter()
+
+        encrypted_password = hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=salt,
+            n=parameters.n,
+            r=parameters.r,
+            p=parameters.p,
+            maxmem=parameters.maxmem,
+            dklen=32,
+        )
+
+        finished_at = time.perf_counter()
+        queue_wait = started_at - submitted_at
+        hash_time = finished_at - started_at
+
+        with self._stats_lock:
+            self.stats.completed += 1
+            self.stats.queue_wait_seconds_total += queue_wait
+            self.stats.queue_wait_seconds_max = max(
+                self.stats.queue_wait_seconds_max, queue_wait
+            )
+            self.stats.hash_seconds_total += hash_time
+            self.stats.hash_seconds_max = max(self.stats.hash_seconds_max, hash_time)
+
+        return encrypted_password
+
+
+global_password_hasher = PasswordHasher(
+    max_workers=int(os.environ.get("VILLAGE_SCRYPT_WORKERS", 2)),
+    max_queued=int(os.environ.get("VILLAGE_SCRYPT_QUEUE", 8)),
+)
@@ -1,8 +1,242 @@
-from itertools import chain
+import bisect
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
 from village.models.posts import Post, PostID
+from village.models.users import Username
+from village.post_records import PostRecord
+
+PostCursor = tuple[datetime, PostID]
+
+
+@dataclass
+class ThreadSummary:
+    root_id: PostID
+    reply_count: int
+    # the newest post in the thread; a reader who has seen up to some cursor
+    # has unread posts if this is past it
+    high_water_mark: PostCursor
+    # author -> number of posts in the thread
+    participants: Counter[Username]
+
+    @property
+    def last_activity(self) -> datetime:
+        return self.high_water_mark[0]
+
+
+class PostGraph:
+    def __init__(self) -> None:
+        self._timestamps: dict[PostID, datetime] = {}
+        self._parents: dict[PostID, tuple[PostID, ...]] = {}
+        self._children: dict[PostID, list[PostID]] = {}
+        self._roots: dict[PostID, PostID] = {}
+        self._top_level: list[PostCursor] = []
+
+        self._authors: dict[PostID, Username] = {}
+        # which thread each post has been counted in, and the threads ordered
+        # by (last activity, root id)
+        self._counted_in: dict[PostID, PostID] = {}
+        self._threads: dict[PostID, ThreadSummary] = {}
+        self._by_activity: list[PostCursor] = []
+
+    def __contains__(self, post_id: PostID) -> bool:
+        return post_id in self._timestamps
+
+    def _sort_key(self, post_id: PostID) -> PostCursor:
+        return self._timestamps[post_id], post_id
+
+    def add_post(self, post: Post | PostRecord) -> None:
+        if post.id in self._timestamps:
+            self.remove_post(post.id)
+
+        self._timestamps[post.id] = post.timestamp
+        self._authors[post.id] = post.author
+        self._parents[post.id] = tuple(dict.fromkeys(post.context))
+
+        for parent_id in self._parents[post.id]:
+            bisect.insort(
+                self._children.setdefault(parent_id, []),
+                post.id,
+                key=self._sort_key,
+            )
+
+        if not self._parents[post.id]:
+            bisect.insort(self._top_level, self._sort_key(post.id))
+
+        # usually just this post, walking up to its root; replies that arrived
+        # before it are counted now too
+        root_id = self.thread_root(post.id)
+        if root_id is not None:
+            self._count_subtree(post.id, root_id=root_id)
+
+    def remove_post(self, post_id: PostID) -> None:
+        if post_id not in self._timestamps:
+            return
+
+        # the post's replies may have resolved their root, and been counted,
+        # through it
+        descendant_ids = self.collect_thread(post_id)
+        for descendant_id in descendant_ids:
+            self._roots.pop(descendant_id, None)
+
+        affected = [
+            descendant_id
+            for descendant_id in descendant_ids
+            if descendant_id in self._counted_in
+        ]
+        affected_roots = {self._counted_in[descendant_id] for descendant_id in affected}
+        for root_id in affected_roots:
+            self._discard_thread(root_id)
+
+        if not self._parents[post_id]:
+            top_level_key = self._sort_key(post_id)
+            del self._top_level[bisect.bisect_left(self._top_level, top_level_key)]
+
+        for parent_id in self._parents.pop(post_id):
+            siblings = self._children[parent_id]
+            siblings.remove(post_id)
+            if not siblings:
+                del self._children[parent_id]
+
+        del self._timestamps[post_id]
+        del self._authors[post_id]
+
+        for root_id in affected_roots:
+            if root_id in self._timestamps:
+                self._count_subtree(root_id, root_id=root_id)
+        # and some may now resolve through another parent
+        for descendant_id in descendant_ids:
+            if (
+                descendant_id in self._timestamps
+                and descendant_id not in self._counted_in
+            ):
+                descendant_root_id = self.thread_root(descendant_id)
+                if descendant_root_id is not None:
+                    self._count_subtree(descendant_id, root_id=descendant_root_id)
+
+    def _count_subtree(self, post_id: PostID, *, root_id: PostID) -> None:
+        if post_id not in self._children:
+            # the usual case: a new reply, with nothing below it yet
+            if post_id not in self._counted_in:
+                self._count_post(post_id, root_id=root_id)
+            return
+
+        for descendant_id in self.collect_thread(post_id):
+            if (
+                descendant_id not in self._counted_in
+                and self.thread_root(descendant_id) == root_id
+            ):
+                self._count_post(descendant_id, root_id=root_id)
+
+    def _count_post(self, post_id: PostID, *, root_id: PostID) -> None:
+        self._counted_in[post_id] = root_id
+        sort_key = self._sort_key(post_id)
+
+        summary = self._threads.get(root_id)
+        if summary is None:
+            summary = self._threads[root_id] = ThreadSummary(
+                root_id=root_id,
+                reply_count=0,
+                high_water_mark=sort_key,
+                participants=Counter(),
+            )
+            bisect.insort(self._by_activity, (summary.last_activity, root_id))
+        else:
+            summary.reply_count += 1
+            if sort_key > summary.high_water_mark:
+                self._remove_from_activity_order(summary)
+                summary.high_water_mark = sort_key
+                bisect.insort(self._by_activity, (summary.last_activity, root_id))
+
+        summary.participants[self._authors[post_id]] += 1
+
+    def _discard_thread(self, root_id: PostID) -> None:
+        summary = self._threads.pop(root_id, None)
+        if summary is None:
+            return
+
+        self._remove_from_activity_order(summary)
+        for post_id in self.collect_thread(root_id):
+            if self._counted_in.get(post_id) == root_id:
+                del self._counted_in[post_id]
+
+    def _remove_from_activity_order(self, summary: ThreadSummary) -> None:
+        activity_key = (summary.last_activity, summary.root_id)
+        del self._by_activity[bisect.bisect_left(self._by_activity, activity_key)]
+
+    def thread_summary(self, root_id: PostID) -> Optional[ThreadSummary]:
+        return self._threads.get(root_id)
+
+    def top_level_page(
+        self, *, before: Optional[PostCursor], limit: int
+    ) -> tuple[list[PostID], Optional[PostCursor]]:
+        return self._page(self._top_level, before=before, limit=limit)
+
+    def active_threads_page(
+        self, *, before: Optional[PostCursor], limit: int
+    ) -> tuple[list[PostID], Optional[PostCursor]]:
+        # thread roots, most recently active first; cursors are
+        # (last activity, root id)
+        return self._page(self._by_activity, before=before, limit=limit)
+
+    def _page(
+        self, ordered: list[PostCursor], *, before: Optional[PostCursor], limit: int
+    ) -> tuple[list[PostID], Optional[PostCursor]]:
+        end = (
+            bisect.bisect_left(ordered, before) if before is not None else len(ordered)
+        )
+        start = max(0, end - limit)
+
+        page = ordered[start:end]
+        next_cursor = page[0] if start > 0 else None
+
+        return [post_id for _, post_id in reversed(page)], next_cursor
+
+    def children(self, post_id: PostID) -> list[PostID]:
+        return self._children.get(post_id, [])
+
+    def thread_root(self, post_id: PostID) -> Optional[PostID]:
+        path: list[PostID] = []
+        current = post_id
+
+        while current not in self._roots:
+            if self._parents.get(current) == ():
+                self._roots[current] = current
+                break
+
+            known_parents = [
+                parent_id
+                for parent_id in self._parents.get(current, ())
+                if parent_id in self._timestamps
+            ]
+            if not known_parents or current in path:
+                # missing parents or a context cycle; leave it unresolved
+                return None
+
+            path.append(current)
+            current = known_parents[0]
+
+        root = self._roots[current]
+        for descendant_id in path:
+            self._roots[descendant_id] = root
+
+        return root
+
+    def collect_thread(self, top_post_id: PostID) -> list[PostID]:
+        thread = [top_post_id]
+        seen = {top_post_id}
+        to_visit = deque([top_post_id])
+
+        while to_visit:
+            for child_id in self._children.get(to_visit.popleft(), []):
+                if child_id not in seen:
+                    seen.add(child_id)
+                    thread.append(child_id)
+                    to_visit.append(child_id)
 
+        return thread
 
-def calculate_tail_context(posts: list[Post]) -> list[PostID]:
-    all_post_ids = set(post.id for post in posts)
-    posts_already_in_context = set(chain.from_iterable(post.context for post in posts))
-    return list(all_post_ids - posts_already_in_context)
+    def calculate_tail_context(self, thread: Iterable[PostID]) -> list[PostID]:
+        return [post_id for post_id in thread if post_id not in self._children]
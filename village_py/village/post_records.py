@@ -0,0 +1,84 @@
+import sys
+from datetime import datetime
+from typing import Any, Sequence
+
+from village.models.posts import Post, PostID
+from village.models.users import Username
+
+
+# The repository keeps one of these per post instead of a Post model: no
+# per-instance dict, no validation on the way in, and ids and author names
+# are interned, so the many references to a post (its own key, the context
+# of every reply, the post graph) and to an author all share one string.
+#
+# A Post is only built, with to_post(), when one is handed out.
+class PostRecord:
+    __slots__ = ("id", "author", "timestamp", "title", "context", "upload_filename")
+
+    id: PostID
+    author: Username
+    timestamp: datetime
+    title: str
+    context: tuple[PostID, ...]
+    upload_filename: str | None
+
+    def __init__(
+        self,
+        *,
+        id: str,
+        author: str,
+        timestamp: datetime,
+        title: str,
+        context: Sequence[PostID],
+        upload_filename: str | None,
+    ) -> None:
+        self.id = PostID(sys.intern(id))
+        self.author = Username(sys.intern(author))
+        self.timestamp = timestamp
+        self.title = title
+        self.context = tuple(PostID(sys.intern(parent_id)) for parent_id in context)
+        self.upload_filename = upload_filename
+
+    @classmethod
+    def from_post(cls, post: Post) -> "PostRecord":
+        return cls(
+            id=post.id,
+            author=post.author,
+            timestamp=post.timestamp,
+            title=post.title,
+            context=post.context,
+            upload_filename=post.upload_filename,
+        )
+
+    @classmethod
+    def from_trusted_dict(cls, data: dict[str, Any]) -> "PostRecord":
+        # for data this repository wrote itself, as to_dict() does, e.g. in
+        # the snapshot; files on disk still go through Post validation
+        return cls(
+            id=data["id"],
+            author=data["author"],
+            timestamp=datetime.fromisoformat(data["timestamp"]),
+            title=data["title"],
+            context=data["context"],
+            upload_filename=data["upload_filename"],
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "author": self.author,
+            "timestamp": self.timestamp.isoformat(),
+            "title": self.title,
+            "context": list(self.context),
+            "upload_filename": self.upload_filename,
+        }
+
+    def to_post(self) -> Post:
+        return Post.model_construct(
+            id=self.id,
+            author=self.author,
+            timestamp=self.timestamp,
+            title=self.title,
+            context=list(self.context),
+            upload_filename=self.upload_filename,
+        )
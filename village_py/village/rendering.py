@@ -0,0 +1,185 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Literal, Optional
+
+from village.metrics import global_metrics
+
+# markdown and bleach take a while to import, so they are only imported once
+# something is actually rendered
+if TYPE_CHECKING:
+    from bleach.sanitizer import Cleaner
+    from markdown import Markdown
+
+# bleach.sanitizer.ALLOWED_TAGS, spelled out so as not to import bleach here
+BLEACH_ALLOWED_TAGS = frozenset(
+    {
+        "a",
+        "abbr",
+        "acronym",
+        "b",
+        "blockquote",
+        "code",
+        "em",
+        "i",
+        "li",
+        "ol",
+        "strong",
+        "ul",
+    }
+)
+
+OUR_ALLOWED_TAGS = frozenset(
+    BLEACH_ALLOWED_TAGS | {"p", "em", "hr"} | {f"h{n}" for n in range(1, 6 + 1)}
+)
+
+RenderKind = Literal["markdown"] | Literal["clean"]
+
+
+@dataclass
+class RenderCacheStats:
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class RenderCache:
+    def __init__(
+        self,
+        *,
+        max_bytes: int = 64 * 1000 * 1000,
+        persist_path: Optional[str] = None,
+        allowed_tags: frozenset[str] = OUR_ALLOWED_TAGS,
+    ) -> None:
+        self._max_bytes = max_bytes
+        self._persist_path = persist_path
+        self._allowed_tags = allowed_tags
+        self._configuration_digest = hashlib.sha256(
+            ",".join(sorted(allowed_tags)).encode("utf-8")
+        ).digest()
+
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.stats = RenderCacheStats()
+
+        if self._persist_path:
+            os.makedirs(self._persist_path, exist_ok=True)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def render_markdown(self, text: str) -> str:
+        return self._render(kind="markdown", text=text)
+
+    def clean(self, text: str) -> str:
+        return self._render(kind="clean", text=text)
+
+    def _render(self, *, kind: RenderKind, text: str) -> str:
+        key = self._key(kind=kind, text=text)
+
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return html
+
+        html = self._load_persisted(key=key)
+        from_disk = html is not None
+        if html is None:
+            html = self._render_uncached(kind=kind, text=text)
+            self._persist(key=key, html=html)
+
+        with self._lock:
+            if from_disk:
+                self.stats.disk_hits += 1
+            else:
+                self.stats.misses += 1
+            self._store(key=key, html=html)
+
+        return html
+
+    def _key(self, *, kind: RenderKind, text: str) -> str:
+        h = hashlib.sha256(self._configuration_digest)
+        h.update(kind.encode("utf-8"))
+        h.update(b"\0")
+        h.update(text.encode("utf-8"))
+        return h.hexdigest()
+
+    def _entry_size(self, *, key: str, html: str) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(html)
+
+    def _store(self, *, key: str, html: str) -> None:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        entry_size = self._entry_size(key=key, html=html)
+        if entry_size > self._max_bytes:
+            return
+
+        self._entries[key] = html
+        self._size += entry_size
+
+        while self._size > self._max_bytes:
+            evicted_key, evicted_html = self._entries.popitem(last=False)
+            self._size -= self._entry_size(key=evicted_key, html=evicted_html)
+            self.stats.evictions += 1
+
+    def _render_uncached(self, *, kind: RenderKind, text: str) -> str:
+        if kind == "markdown":
+            with global_metrics.phase("markdown"):
+                text = self._markdown().reset().convert(text)
+
+        with global_metrics.phase("bleach"):
+            return self._cleaner().clean(text)
+
+    def _markdown(self) -> "Markdown":
+        md = getattr(self._local, "markdown", None)
+        if md is None:
+            from markdown import Markdown
+
+            md = self._local.markdown = Markdown()
+        return md
+
+    def _cleaner(self) -> "Cleaner":
+        cleaner = getattr(self._local, "cleaner", None)
+        if cleaner is None:
+            from bleach.sanitizer import Cleaner
+
+            cleaner = self._local.cleaner = Cleaner(tags=self._allowed_tags)
+        return cleaner
+
+    def _persisted_path(self, *, key: str) -> str:
+        assert self._persist_path
+        return os.path.join(self._persist_path, key[:2], key + ".html")
+
+    def _load_persisted(self, *, key: str) -> Optional[str]:
+        if not self._persist_path:
+            return None
+
+        try:
+            with open(self._persisted_path(key=key), "rt", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _persist(self, *, key: str, html: str) -> None:
+        if not self._persist_path:
+            return
+
+        path = self._persisted_path(key=key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wt", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(temporary_path, path)
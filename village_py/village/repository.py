@@ -1,27 +1,147 @@
+import contextlib
+import fcntl
+import hashlib
+import itertools
+import multiprocessing
 import os
+import threading
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
-from collections import defaultdict
-from typing import Any, Literal, Optional, Tuple
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 import yaml
 
+try:
+    from yaml import CSafeDumper as YamlDumper, CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeDumper as YamlDumper, SafeLoader as YamlLoader  # type: ignore
+
+from village.journal import ChangeJournal
+from village.metrics import global_metrics
+from village.models.jobs import JobID, ThumbnailJob
 from village.models.users import User, Username
-from village.models.posts import Post, PostID
+from village.models.posts import (
+    Post,
+    PostID,
+    new_time_ordered_post_id,
+    post_id_timestamp,
+)
+from village.post_graph import PostCursor, PostGraph
+from village.post_records import PostRecord
+from village.search import DocumentText, SearchIndex
+from village.snapshot import MetadataSnapshot, SnapshotKind, SnapshotRecord
 
 
 class DoesNotExistException(Exception):
     pass
 
 
+class FileSignature(NamedTuple):
+    mtime_ns: int
+    size: int
+    inode: int
+
+    @classmethod
+    def from_stat(cls, stat: os.stat_result) -> "FileSignature":
+        return cls(mtime_ns=stat.st_mtime_ns, size=stat.st_size, inode=stat.st_ino)
+
+
+class CachedFile(NamedTuple):
+    signature: FileSignature
+    body_offset: int
+
+    @classmethod
+    def from_snapshot_record(cls, record: SnapshotRecord) -> "CachedFile":
+        return cls(
+            signature=FileSignature(
+                mtime_ns=record.mtime_ns, size=record.size, inode=record.inode
+            ),
+            body_offset=record.body_offset,
+        )
+
+    def to_snapshot_record(self, *, key: str, data: dict) -> SnapshotRecord:
+        return SnapshotRecord(
+            key=key,
+            mtime_ns=self.signature.mtime_ns,
+            size=self.signature.size,
+            inode=self.signature.inode,
+            body_offset=self.body_offset,
+            data=data,
+        )
+
+
+class ContentVersion(NamedTuple):
+    token: str
+    last_modified: datetime
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    reloads: int = 0
+    removals: int = 0
+
+
 class Repository:
-    def __init__(self, base_path: str) -> None:
+    def __init__(
+        self,
+        base_path: str,
+        *,
+        use_snapshot: bool = False,
+        use_search_index: bool = False,
+        full_rescan_seconds: float = 0.0,
+    ) -> None:
         self._base_path = os.path.abspath(base_path)
         if not os.path.exists(self._base_path):
             raise Exception(f"{self._base_path} does not exist")
 
+        self._snapshot = (
+            MetadataSnapshot(path=os.path.join(self.cache_path, "metadata.sqlite"))
+            if use_snapshot
+            else None
+        )
+        self._restored_from_snapshot: set[SnapshotKind] = set()
+
+        self.search_index = (
+            SearchIndex(path=os.path.join(self.cache_path, "search.sqlite"))
+            if use_search_index
+            else None
+        )
+        self._reconciled_search_index: set[SnapshotKind] = set()
+
+        # every write is recorded in the journal so that other processes can
+        # refresh just what changed; full directory scans, which also catch
+        # edits made outside of the repository, happen at most this often
+        self._journal = ChangeJournal(path=os.path.join(self.cache_path, "journal.log"))
+        self._full_rescan_seconds = full_rescan_seconds
+        self._scanned_at: dict[SnapshotKind, float] = {}
+
+        self._post_aliases: dict[PostID, PostID] = {}
+        self._post_aliases_signature: Optional[FileSignature] = None
+
         self._users: dict[Username, User] = {}
-        self._posts: dict[PostID, Post] = {}
+        self._user_files: dict[Username, CachedFile] = {}
+        self._user_cache_lock = threading.RLock()
+        self.user_cache_stats = CacheStats()
+
+        self._posts: dict[PostID, PostRecord] = {}
+        self._post_files: dict[PostID, CachedFile] = {}
+        self.post_graph = PostGraph()
+        self._post_cache_lock = threading.Lock()
+        self.post_cache_stats = CacheStats()
 
     @property
     def _users_path(self) -> str:
@@ -35,6 +155,14 @@ class Repository:
     def _posts_path(self) -> str:
         return os.path.join(self._base_path, "posts/")
 
+    @property
+    def _jobs_path(self) -> str:
+        return os.path.join(self._base_path, "jobs/")
+
+    @property
+    def cache_path(self) -> str:
+        return os.path.join(self._base_path, "cache/")
+
     def _ensure_users_path(self) -> None:
         os.makedirs(self._users_path, exist_ok=True)
 
@@ -58,39 +186,169 @@ class Repository:
             if not os.path.exists(self.upload_path_for(filename=filename)):
                 return filename
 
-    def new_post_id(self) -> PostID:
+    def new_post_id(self, *, timestamp: Optional[datetime] = None) -> PostID:
         self._ensure_posts_path()
 
         while True:
-            post_id = PostID(str(uuid.uuid4()))
+            post_id = new_time_ordered_post_id(timestamp or datetime.utcnow())
             if not self._post_exists_in_repository(post_id=post_id):
                 return post_id
 
+    def new_job_id(self) -> JobID:
+        return JobID(str(uuid.uuid4()))
+
     @contextmanager
     def open_uploaded_file(self, *, filename: str, mode: Literal["rt"] | Literal["wt"]):
         with open(self.upload_path_for(filename=filename), mode) as f:
             yield f
 
     def load_all_users(self) -> list[User]:
+        self._populate_user_cache()
+
+        return [user.model_copy() for user in list(self._users.values())]
+
+    def _populate_user_cache(self) -> None:
+        with self._user_cache_lock:
+            changed_usernames = self._changes_since_last_scan(kind="users")
+            if changed_usernames is None:
+                self._rescan_user_files()
+            else:
+                self._refresh_users(
+                    usernames=[Username(username) for username in changed_usernames]
+                )
+
+    def _rescan_user_files(self) -> None:
+        self._restore_users_from_snapshot()
+        self._start_scan(kind="users")
+
+        seen_usernames: set[Username] = set()
+        changed_records: list[SnapshotRecord] = []
+
+        for entry in self._scan_user_files():
+            username = self._username_from_filename(entry.name)
+            seen_usernames.add(username)
+
+            record = self._reload_user_if_changed(
+                username=username, signature=FileSignature.from_stat(entry.stat())
+            )
+            if record is not None:
+                changed_records.append(record)
+
+        removed_usernames = set(self._users) - seen_usernames
+        self._finish_user_refresh(
+            changed_records=changed_records,
+            removed_usernames=removed_usernames,
+            reconcile=True,
+        )
+
+    def _refresh_users(self, *, usernames: Iterable[Username]) -> None:
+        changed_records: list[SnapshotRecord] = []
+        removed_usernames: set[Username] = set()
+
+        for username in usernames:
+            try:
+                signature = FileSignature.from_stat(
+                    os.stat(self._user_path(username=username))
+                )
+            except FileNotFoundError:
+                if username in self._users:
+                    removed_usernames.add(username)
+                continue
+
+            record = self._reload_user_if_changed(
+                username=username, signature=signature
+            )
+            if record is not None:
+                changed_records.append(record)
+
+        self._finish_user_refresh(
+            changed_records=changed_records, removed_usernames=removed_usernames
+        )
+
+    def _reload_user_if_changed(
+        self, *, username: Username, signature: FileSignature
+    ) -> Optional[SnapshotRecord]:
+        cached_file = self._user_files.get(username)
+        if cached_file and cached_file.signature == signature:
+            self.user_cache_stats.hits += 1
+            return None
+
+        user, cached_file = self._read_user_file(username=username)
+        self._cache_user(user=user, cached_file=cached_file)
+        self.user_cache_stats.reloads += 1
+
+        return self._user_snapshot_record(user=user, cached_file=cached_file)
+
+    def _finish_user_refresh(
+        self,
+        *,
+        changed_records: list[SnapshotRecord],
+        removed_usernames: set[Username],
+        reconcile: bool = False,
+    ) -> None:
+        for username in removed_usernames:
+            self._uncache_user(username=username)
+            self.user_cache_stats.removals += 1
+
+        self._update_snapshot(
+            kind="users", records=changed_records, removed_keys=removed_usernames
+        )
+        self._reindex_users(
+            usernames=[Username(record.key) for record in changed_records],
+            removed_usernames=removed_usernames,
+            reconcile=reconcile,
+        )
+
+    @global_metrics.timed("snapshot")
+    def _restore_users_from_snapshot(self) -> None:
+        if self._snapshot is None or "users" in self._restored_from_snapshot:
+            return
+
+        with self._user_cache_lock:
+            for record in self._snapshot.load(kind="users"):
+                self._cache_user(
+                    user=self._user_from_dict(data=record.data),
+                    cached_file=CachedFile.from_snapshot_record(record),
+                )
+
+            self._restored_from_snapshot.add("users")
+
+    def _user_snapshot_record(
+        self, *, user: User, cached_file: CachedFile
+    ) -> SnapshotRecord:
+        return cached_file.to_snapshot_record(
+            key=user.username, data=self._user_to_dict(user=user)
+        )
+
+    @global_metrics.timed("directory_scan")
+    def _scan_user_files(self) -> list[os.DirEntry]:
+        # a new repository has no users/ until the first user is created
+        if not os.path.isdir(self._users_path):
+            return []
+
         return [
-            self.load_user(username=username) for username in self._load_all_usernames()
+            entry
+            for entry in os.scandir(self._users_path)
+            if entry.is_file() and entry.name.endswith(".yaml")
         ]
 
+    def _username_from_filename(self, filename: str) -> Username:
+        username, _ = os.path.splitext(os.path.basename(filename))
+        return Username(username)
+
     def _load_all_usernames(self) -> list[Username]:
         return [
-            Username(username)
-            for username, _ in (
-                os.path.splitext(os.path.basename(entry.name))
-                for entry in os.scandir(self._users_path)
-                if entry.is_file()
-            )
+            self._username_from_filename(entry.name)
+            for entry in self._scan_user_files()
         ]
 
     @contextmanager
     def _open_user_file(
-        self, *, username: Username, mode: Literal["rt"] | Literal["wt"]
+        self, *, username: Username, mode: Literal["rb"] | Literal["wt"]
     ):
-        with open(self._user_path(username=username), mode, encoding="utf-8") as f:
+        with self._open_repository_file(
+            path=self._user_path(username=username), mode=mode
+        ) as f:
             yield f
 
     def _user_exists_in_repository(self, *, username: Username) -> bool:
@@ -101,39 +359,81 @@ class Repository:
             raise DoesNotExistException(f"{username} could not be found")
 
     def load_user(self, *, username: Username) -> User:
+        user, cached_file = self._read_user_file(username=username)
+
+        with self._user_cache_lock:
+            self._cache_user(user=user, cached_file=cached_file)
+            self.user_cache_stats.reloads += 1
+            self._update_snapshot(
+                kind="users",
+                records=[
+                    self._user_snapshot_record(user=user, cached_file=cached_file)
+                ],
+            )
+            self._reindex_users(usernames=[username])
+
+        return user
+
+    def _read_user_file(self, *, username: Username) -> Tuple[User, CachedFile]:
         self._user_must_exist(username=username)
 
-        with self._open_user_file(username=username, mode="rt") as f:
-            data, _ = self._load_yaml_prefix_and_content(f)
+        with self._open_user_file(username=username, mode="rb") as f:
+            signature = FileSignature.from_stat(os.fstat(f.fileno()))
+            data, body_offset = self._load_yaml_prefix(f)
+
+        user = self._user_from_dict(data=data)
 
+        return user, CachedFile(signature=signature, body_offset=body_offset)
+
+    @global_metrics.timed("validate")
+    def _user_from_dict(self, *, data: dict[str, Any]) -> User:
+        data = dict(data)
         for field in ("password_salt", "encrypted_password"):
             data[field] = bytes.fromhex(data[field])
 
-        user = User.model_validate(data)
+        return User.model_validate(data)
 
-        self._cache_user(user=user)
+    def get_user(self, *, username: Username) -> User:
+        self._restore_users_from_snapshot()
 
-        return user
+        try:
+            signature = FileSignature.from_stat(
+                os.stat(self._user_path(username=username))
+            )
+        except FileNotFoundError:
+            with self._user_cache_lock:
+                self._uncache_user(username=username)
+                self._update_snapshot(kind="users", removed_keys=[username])
+                self._reindex_users(usernames=[], removed_usernames=[username])
+            raise DoesNotExistException(f"{username} could not be found")
 
-    def get_user(self, *, username: Username) -> User:
-        if username in self._users:
-            return self._users[username]
+        with self._user_cache_lock:
+            cached_file = self._user_files.get(username)
+            if cached_file and cached_file.signature == signature:
+                self.user_cache_stats.hits += 1
+                return self._users[username].model_copy()
 
         return self.load_user(username=username)
 
     def load_user_content(self, *, username: Username) -> str:
         self._user_must_exist(username=username)
 
-        with self._open_user_file(username=username, mode="rt") as f:
-            _, content = self._load_yaml_prefix_and_content(f)
+        with self._open_user_file(username=username, mode="rb") as f:
+            cached_file = self._user_files.get(username)
+            signature = FileSignature.from_stat(os.fstat(f.fileno()))
+
+            if cached_file and cached_file.signature == signature:
+                body_offset = cached_file.body_offset
+            else:
+                body_offset = self._find_body_offset(f)
 
-            return content
+            return self._load_content(f, body_offset=body_offset)
 
     def _write_user(
         self, *, username: Username, user: User | None, content: str | None
-    ) -> None:
+    ) -> CachedFile:
         if self._user_exists_in_repository(username=username):
-            with self._open_user_file(username=username, mode="rt") as f:
+            with self._open_user_file(username=username, mode="rb") as f:
                 current_data, current_content = self._load_yaml_prefix_and_content(f)
         else:
             current_data, current_content = None, None
@@ -152,7 +452,16 @@ class Repository:
             raise Exception(f"missing data or content: {new_data}; {new_content}")
 
         with self._open_user_file(username=username, mode="wt") as f:
-            self._write_yaml_prefix_and_content(f=f, data=new_data, content=new_content)
+            body_offset = self._write_yaml_prefix_and_content(
+                f=f, data=new_data, content=new_content
+            )
+
+        return CachedFile(
+            signature=FileSignature.from_stat(
+                os.stat(self._user_path(username=username))
+            ),
+            body_offset=body_offset,
+        )
 
     def create_user(self, *, user: User) -> None:
         if self._user_exists_in_repository(username=user.username):
@@ -160,19 +469,56 @@ class Repository:
                 f"This user already exists: {self.load_user(username=user.username)}"
             )
 
-        self._write_user(username=user.username, user=user, content="")
-        self._cache_user(user=user)
+        with self._user_cache_lock:
+            cached_file = self._write_user(
+                username=user.username, user=user, content=""
+            )
+            self._journal.record(kind="users", keys=[user.username])
+            self._cache_user(user=user, cached_file=cached_file)
+            self._update_snapshot(
+                kind="users",
+                records=[
+                    self._user_snapshot_record(user=user, cached_file=cached_file)
+                ],
+            )
+            self._reindex_users(usernames=[user.username])
 
     def update_user(self, *, user: User) -> None:
         self._ensure_users_path()
 
-        self._write_user(username=user.username, user=user, content=None)
-        self._cache_user(user=user)
+        with self._user_cache_lock:
+            cached_file = self._write_user(
+                username=user.username, user=user, content=None
+            )
+            self._journal.record(kind="users", keys=[user.username])
+            self._cache_user(user=user, cached_file=cached_file)
+            self._update_snapshot(
+                kind="users",
+                records=[
+                    self._user_snapshot_record(user=user, cached_file=cached_file)
+                ],
+            )
+            self._reindex_users(usernames=[user.username])
 
     def update_user_content(self, *, username: Username, content: str) -> None:
         self._user_must_exist(username=username)
 
-        self._write_user(username=username, user=None, content=content)
+        with self._user_cache_lock:
+            cached_file = self._write_user(
+                username=username, user=None, content=content
+            )
+            self._journal.record(kind="users", keys=[username])
+            if username in self._users:
+                self._user_files[username] = cached_file
+                self._update_snapshot(
+                    kind="users",
+                    records=[
+                        self._user_snapshot_record(
+                            user=self._users[username], cached_file=cached_file
+                        )
+                    ],
+                )
+                self._reindex_users(usernames=[username])
 
     def _user_to_dict(self, *, user: User) -> dict[str, Any]:
         d = user.dict()
@@ -182,68 +528,542 @@ class Repository:
 
         return d
 
-    def _cache_user(self, *, user: User) -> None:
-        self._users[user.username] = user
+    def _cache_user(self, *, user: User, cached_file: CachedFile) -> None:
+        self._users[user.username] = user.model_copy()
+        self._user_files[user.username] = cached_file
+
+    def _uncache_user(self, *, username: Username) -> None:
+        self._users.pop(username, None)
+        self._user_files.pop(username, None)
+
+    @global_metrics.timed("search_index")
+    def _reindex_users(
+        self,
+        *,
+        usernames: Iterable[Username],
+        removed_usernames: Iterable[Username] = (),
+        reconcile: bool = False,
+    ) -> None:
+        if self.search_index is None:
+            return
+
+        usernames = set(usernames)
+        removed_keys = {
+            self._user_search_key(username) for username in removed_usernames
+        }
+
+        if reconcile and "users" not in self._reconciled_search_index:
+            # pick up whatever changed while the server was not running
+            usernames.update(
+                username
+                for username, cached_file in self._user_files.items()
+                if not self._search_index_is_current(
+                    key=self._user_search_key(username), cached_file=cached_file
+                )
+            )
+            removed_keys.update(
+                key
+                for key in self.search_index.keys()
+                if key.startswith("user:") and key[5:] not in self._users
+            )
+            self._reconciled_search_index.add("users")
+
+        documents = []
+        for username in usernames:
+            user = self._users.get(username)
+            cached_file = self._user_files.get(username)
+            if user is None or cached_file is None:
+                continue
+
+            text = "\n".join(
+                (
+                    user.username,
+                    user.display_name,
+                    self.load_user_content(username=username),
+                )
+            )
+            documents.append(
+                self._search_document(
+                    key=self._user_search_key(username),
+                    cached_file=cached_file,
+                    text=text,
+                )
+            )
+
+        self.search_index.update(documents=documents, removed_keys=removed_keys)
+
+    def _user_search_key(self, username: Username) -> str:
+        return "user:" + username
+
+    def _search_index_is_current(self, *, key: str, cached_file: CachedFile) -> bool:
+        assert self.search_index is not None
+
+        signature = cached_file.signature
+        return self.search_index.is_current(
+            key=key,
+            mtime_ns=signature.mtime_ns,
+            size=signature.size,
+            inode=signature.inode,
+        )
+
+    def _search_document(
+        self, *, key: str, cached_file: CachedFile, text: str
+    ) -> DocumentText:
+        signature = cached_file.signature
+        return DocumentText(
+            key=key,
+            mtime_ns=signature.mtime_ns,
+            size=signature.size,
+            inode=signature.inode,
+            text=text,
+        )
+
+    def search(self, *, query: str, limit: int) -> Tuple[list[Post], list[User]]:
+        if self.search_index is None:
+            raise Exception("this repository has no search index")
+
+        # the index is kept current on every write and reload, so only the
+        # first search needs to reconcile it with the files on disk
+        if "posts" not in self._reconciled_search_index:
+            self._populate_post_cache()
+        if "users" not in self._reconciled_search_index:
+            self._populate_user_cache()
+
+        posts: list[Post] = []
+        users: list[User] = []
+        for result in self.search_index.search(query, limit=limit):
+            kind, _, key = result.key.partition(":")
+            if kind == "post":
+                with self._post_cache_lock:
+                    record = self._posts.get(PostID(key))
+                if record is not None:
+                    posts.append(record.to_post())
+            elif kind == "user" and key in self._users:
+                users.append(self._users[Username(key)].model_copy())
+
+        return posts, users
+
+    def content_version(
+        self,
+        *,
+        post_ids: Iterable[PostID] = (),
+        usernames: Iterable[Username] = (),
+    ) -> ContentVersion:
+        # built from the cached file signatures alone, so callers should have
+        # just loaded the posts and users in question
+        h = hashlib.sha256()
+        latest_mtime_ns = 0
+
+        for kind, keys, cached_files in (
+            ("post", post_ids, self._post_files),
+            ("user", usernames, self._user_files),
+        ):
+            for key in keys:
+                h.update(f"{kind}:{key}:".encode("utf-8"))
+                cached_file = cached_files.get(key)  # type: ignore
+                if cached_file is not None:
+                    h.update(repr(tuple(cached_file.signature)).encode("utf-8"))
+                    latest_mtime_ns = max(
+                        latest_mtime_ns, cached_file.signature.mtime_ns
+                    )
+                h.update(b"\n")
+
+        return ContentVersion(
+            token=h.hexdigest(),
+            last_modified=datetime.fromtimestamp(
+                latest_mtime_ns // 1_000_000_000, tz=timezone.utc
+            ),
+        )
+
+    def _changes_since_last_scan(self, *, kind: SnapshotKind) -> Optional[set[str]]:
+        # None means a full rescan is due, otherwise these are the keys that
+        # some process has written since we last looked
+        scanned_at = self._scanned_at.get(kind)
+        if (
+            scanned_at is None
+            or time.monotonic() - scanned_at >= self._full_rescan_seconds
+        ):
+            return None
+
+        return self._journal.read_changes(kind=kind)
+
+    def _start_scan(self, *, kind: SnapshotKind) -> None:
+        # anything written from here on will be in the journal, and anything
+        # before is picked up by the scan that follows
+        self._journal.mark_read(kind=kind)
+        self._scanned_at[kind] = time.monotonic()
+
+    @global_metrics.timed("snapshot")
+    def _update_snapshot(
+        self,
+        *,
+        kind: SnapshotKind,
+        records: Iterable[SnapshotRecord] = (),
+        removed_keys: Iterable[str] = (),
+    ) -> None:
+        if self._snapshot is not None:
+            self._snapshot.update(kind=kind, records=records, removed_keys=removed_keys)
 
     CONTENT_SEPARATOR = "------\n"
+    _CONTENT_SEPARATOR_BYTES = CONTENT_SEPARATOR.encode("utf-8")
+    # files edited by hand may have CRLF line endings
+    _CONTENT_SEPARATORS_READ = (_CONTENT_SEPARATOR_BYTES, b"------\r\n")
 
-    def _load_yaml_prefix_and_content(self, f) -> Tuple[dict, str]:
-        yaml_lines: list[str] = []
-        content_lines: list[str] = []
-        care_about_separator = True
+    @contextmanager
+    def _open_repository_file(self, *, path: str, mode: Literal["rb"] | Literal["wt"]):
+        if "b" in mode:
+            with open(path, mode) as f:
+                yield f
+            return
+
+        # written beside the file and moved over it, so that readers in other
+        # threads, like the warm-up's, never see one half written; and as is,
+        # so that the body offset we return is exact
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary_path, mode, encoding="utf-8", newline="\n") as f:
+                yield f
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def _read_yaml_prefix(self, f) -> Tuple[bytes, int]:
+        yaml_lines: list[bytes] = []
+        body_offset = 0
 
-        target = yaml_lines
         for line in f:
-            if care_about_separator and line == self.CONTENT_SEPARATOR:
-                target = content_lines
-                care_about_separator = False
-                continue
-            target.append(line)
+            body_offset += len(line)
+            if line in self._CONTENT_SEPARATORS_READ:
+                break
+            yaml_lines.append(line)
+
+        return b"".join(yaml_lines), body_offset
+
+    def _find_body_offset(self, f) -> int:
+        body_offset = 0
 
-        return yaml.full_load("".join(yaml_lines)), "".join(content_lines)
+        for line in f:
+            body_offset += len(line)
+            if line in self._CONTENT_SEPARATORS_READ:
+                break
+
+        return body_offset
+
+    @global_metrics.timed("yaml_parse")
+    def _load_yaml_prefix(self, f) -> Tuple[dict, int]:
+        yaml_prefix, body_offset = self._read_yaml_prefix(f)
+
+        return yaml.load(yaml_prefix, Loader=YamlLoader), body_offset
+
+    @global_metrics.timed("read_content")
+    def _load_content(self, f, *, body_offset: int) -> str:
+        f.seek(body_offset)
 
-    def _write_yaml_prefix_and_content(self, *, f, data: dict, content: str):
-        yaml.dump(data, f)
+        content = f.read().decode("utf-8")
+        if "\r" in content:
+            # as text mode reading used to, for files with CRLF line endings
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+        return content
 
+    def _load_yaml_prefix_and_content(self, f) -> Tuple[dict, str]:
+        data, body_offset = self._load_yaml_prefix(f)
+
+        return data, self._load_content(f, body_offset=body_offset)
+
+    @global_metrics.timed("write")
+    def _write_yaml_prefix_and_content(self, *, f, data: dict, content: str) -> int:
+        yaml_prefix = yaml.dump(data, Dumper=YamlDumper)
+
+        f.write(yaml_prefix)
         f.write(self.CONTENT_SEPARATOR)
         f.write(content)
 
+        return len(yaml_prefix.encode("utf-8")) + len(self._CONTENT_SEPARATOR_BYTES)
+
     def load_all_top_level_posts(self) -> list[Post]:
         self._populate_post_cache()
 
-        return [p for p in self._posts.values() if not p.context]
+        # under the lock, as other threads may be caching posts meanwhile
+        with self._post_cache_lock:
+            return [p.to_post() for p in self._posts.values() if not p.context]
+
+    def load_top_level_posts_page(
+        self, *, before: Optional[PostCursor], limit: int
+    ) -> Tuple[list[Post], Optional[PostCursor]]:
+        self._populate_post_cache()
+
+        with self._post_cache_lock:
+            post_ids, next_cursor = self.post_graph.top_level_page(
+                before=before, limit=limit
+            )
+
+            return [self._posts[post_id].to_post() for post_id in post_ids], next_cursor
+
+    def load_active_threads_page(
+        self, *, before: Optional[PostCursor], limit: int
+    ) -> Tuple[list[Post], Optional[PostCursor]]:
+        self._populate_post_cache()
+
+        with self._post_cache_lock:
+            post_ids, next_cursor = self.post_graph.active_threads_page(
+                before=before, limit=limit
+            )
+
+            return [self._posts[post_id].to_post() for post_id in post_ids], next_cursor
 
     def _populate_post_cache(self) -> None:
-        self._posts = {
-            p.id: p
-            for p in (
-                self.load_post(post_id=post_id) for post_id in self._load_all_post_ids()
+        with self._post_cache_lock:
+            changed_post_ids = self._changes_since_last_scan(kind="posts")
+            if changed_post_ids is None:
+                self._rescan_post_files()
+            else:
+                self._refresh_posts(
+                    post_ids=[PostID(post_id) for post_id in changed_post_ids]
+                )
+
+    def _rescan_post_files(self) -> None:
+        self._restore_posts_from_snapshot()
+        self._start_scan(kind="posts")
+
+        seen_post_ids: set[PostID] = set()
+        changed_records: list[SnapshotRecord] = []
+
+        for entry in self._scan_post_files():
+            post_id = self._post_id_from_filename(entry.name)
+            seen_post_ids.add(post_id)
+
+            record = self._reload_post_if_changed(
+                post_id=post_id, signature=FileSignature.from_stat(entry.stat())
             )
-        }
+            if record is not None:
+                changed_records.append(record)
+
+        removed_post_ids = set(self._posts) - seen_post_ids
+        self._finish_post_refresh(
+            changed_records=changed_records,
+            removed_post_ids=removed_post_ids,
+            reconcile=True,
+        )
+
+    def _refresh_posts(self, *, post_ids: Iterable[PostID]) -> None:
+        changed_records: list[SnapshotRecord] = []
+        removed_post_ids: set[PostID] = set()
+
+        for post_id in post_ids:
+            try:
+                signature = FileSignature.from_stat(
+                    os.stat(self._post_path(post_id=post_id))
+                )
+            except FileNotFoundError:
+                if post_id in self._posts:
+                    removed_post_ids.add(post_id)
+                continue
+
+            record = self._reload_post_if_changed(post_id=post_id, signature=signature)
+            if record is not None:
+                changed_records.append(record)
+
+        self._finish_post_refresh(
+            changed_records=changed_records, removed_post_ids=removed_post_ids
+        )
+
+    def _reload_post_if_changed(
+        self, *, post_id: PostID, signature: FileSignature
+    ) -> Optional[SnapshotRecord]:
+        cached_file = self._post_files.get(post_id)
+        if cached_file and cached_file.signature == signature:
+            self.post_cache_stats.hits += 1
+            return None
+
+        post, cached_file = self._read_post_file(post_id=post_id)
+        record = self._cache_post(post=post, cached_file=cached_file)
+        self.post_cache_stats.reloads += 1
+
+        return self._post_snapshot_record(record=record, cached_file=cached_file)
+
+    def _finish_post_refresh(
+        self,
+        *,
+        changed_records: list[SnapshotRecord],
+        removed_post_ids: set[PostID],
+        reconcile: bool = False,
+    ) -> None:
+        for post_id in removed_post_ids:
+            self._uncache_post(post_id=post_id)
+            self.post_cache_stats.removals += 1
+
+        self._update_snapshot(
+            kind="posts", records=changed_records, removed_keys=removed_post_ids
+        )
+        self._reindex_posts(
+            post_ids=[PostID(record.key) for record in changed_records],
+            removed_post_ids=removed_post_ids,
+            reconcile=reconcile,
+        )
+
+    @global_metrics.timed("snapshot")
+    def _restore_posts_from_snapshot(self) -> None:
+        if self._snapshot is None or "posts" in self._restored_from_snapshot:
+            return
+
+        for record in self._snapshot.load(kind="posts"):
+            # the snapshot only holds what we wrote, so skip validation
+            self._cache_post_record(
+                record=PostRecord.from_trusted_dict(record.data),
+                cached_file=CachedFile.from_snapshot_record(record),
+            )
+
+        self._restored_from_snapshot.add("posts")
+
+    def _post_snapshot_record(
+        self, *, record: PostRecord, cached_file: CachedFile
+    ) -> SnapshotRecord:
+        return cached_file.to_snapshot_record(key=record.id, data=record.to_dict())
+
+    @global_metrics.timed("search_index")
+    def _reindex_posts(
+        self,
+        *,
+        post_ids: Iterable[PostID],
+        removed_post_ids: Iterable[PostID] = (),
+        reconcile: bool = False,
+        contents: Optional[dict[PostID, str]] = None,
+    ) -> None:
+        if self.search_index is None:
+            return
+
+        post_ids = set(post_ids)
+        removed_keys = {self._post_search_key(post_id) for post_id in removed_post_ids}
+
+        if reconcile and "posts" not in self._reconciled_search_index:
+            # pick up whatever changed while the server was not running
+            post_ids.update(
+                post_id
+                for post_id, cached_file in self._post_files.items()
+                if not self._search_index_is_current(
+                    key=self._post_search_key(post_id), cached_file=cached_file
+                )
+            )
+            removed_keys.update(
+                key
+                for key in self.search_index.keys()
+                if key.startswith("post:") and key[5:] not in self._posts
+            )
+            self._reconciled_search_index.add("posts")
+
+        documents = []
+        for post_id in post_ids:
+            post = self._posts.get(post_id)
+            cached_file = self._post_files.get(post_id)
+            if post is None or cached_file is None:
+                continue
+
+            content = (contents or {}).get(post_id)
+            if content is None:
+                content = self.load_post_content(post_id=post_id)
+            text = post.title + "\n" + content
+            documents.append(
+                self._search_document(
+                    key=self._post_search_key(post_id),
+                    cached_file=cached_file,
+                    text=text,
+                )
+            )
+
+        self.search_index.update(documents=documents, removed_keys=removed_keys)
+
+    def _post_search_key(self, post_id: PostID) -> str:
+        return "post:" + post_id
+
+    def _cache_post(self, *, post: Post, cached_file: CachedFile) -> PostRecord:
+        record = PostRecord.from_post(post)
+        self._cache_post_record(record=record, cached_file=cached_file)
+        return record
+
+    def _cache_post_record(
+        self, *, record: PostRecord, cached_file: CachedFile
+    ) -> None:
+        self._posts[record.id] = record
+        self._post_files[record.id] = cached_file
+        self.post_graph.add_post(record)
+
+    def _uncache_post(self, *, post_id: PostID) -> None:
+        self._posts.pop(post_id, None)
+        self._post_files.pop(post_id, None)
+        self.post_graph.remove_post(post_id)
+
+    @global_metrics.timed("directory_scan")
+    def _scan_post_files(
+        self, *, since: Optional[datetime] = None
+    ) -> list[os.DirEntry]:
+        # posts/YYYY/MM/ shards, plus flat legacy files, which are undated and
+        # so always included
+        first_shard = (since.year, since.month) if since else None
+        if not os.path.isdir(self._posts_path):
+            return []
+
+        entries = []
+        for entry in os.scandir(self._posts_path):
+            if entry.is_file() and entry.name.endswith(".yaml"):
+                entries.append(entry)
+                continue
+
+            if not (entry.is_dir() and entry.name.isdigit()):
+                continue
+            year = int(entry.name)
+            if first_shard and year < first_shard[0]:
+                continue
+
+            for month_entry in os.scandir(entry.path):
+                if not (month_entry.is_dir() and month_entry.name.isdigit()):
+                    continue
+                if first_shard and (year, int(month_entry.name)) < first_shard:
+                    continue
+
+                entries.extend(
+                    post_entry
+                    for post_entry in os.scandir(month_entry.path)
+                    if post_entry.is_file() and post_entry.name.endswith(".yaml")
+                )
+
+        return entries
+
+    def _post_id_from_filename(self, filename: str) -> PostID:
+        post_id, _ = os.path.splitext(os.path.basename(filename))
+        return PostID(post_id)
 
     def _load_all_post_ids(self) -> list[PostID]:
         return [
-            PostID(post_id)
-            for post_id, _ in (
-                os.path.splitext(os.path.basename(entry.name))
-                for entry in os.scandir(self._posts_path)
-                if entry.is_file()
-            )
+            self._post_id_from_filename(entry.name) for entry in self._scan_post_files()
         ]
 
     def load_post(self, *, post_id: PostID) -> Post:
+        post, _ = self._read_post_file(post_id=post_id)
+
+        return post
+
+    def _read_post_file(self, *, post_id: PostID) -> Tuple[Post, CachedFile]:
         self._post_must_exist(post_id=post_id)
 
-        with self._open_post_file(post_id=post_id, mode="rt") as f:
-            data, _ = self._load_yaml_prefix_and_content(f)
+        with self._open_post_file(post_id=post_id, mode="rb") as f:
+            signature = FileSignature.from_stat(os.fstat(f.fileno()))
+            data, body_offset = self._load_yaml_prefix(f)
 
-        post = Post.model_validate(data)
+        post = self._post_from_dict(data=data)
 
-        return post
+        return post, CachedFile(signature=signature, body_offset=body_offset)
+
+    @global_metrics.timed("validate")
+    def _post_from_dict(self, *, data: dict[str, Any]) -> Post:
+        return Post.model_validate(data)
 
     @contextmanager
-    def _open_post_file(self, *, post_id: PostID, mode: Literal["rt"] | Literal["wt"]):
-        with open(self._post_path(post_id=post_id), mode, encoding="utf-8") as f:
+    def _open_post_file(self, *, post_id: PostID, mode: Literal["rb"] | Literal["wt"]):
+        with self._open_repository_file(
+            path=self._post_path(post_id=post_id), mode=mode
+        ) as f:
             yield f
 
     def _post_must_exist(self, *, post_id: PostID):
@@ -254,55 +1074,438 @@ class Repository:
         return os.path.exists(self._post_path(post_id=post_id))
 
     def _post_path(self, post_id: PostID) -> str:
-        return os.path.join(self._posts_path, post_id + ".yaml")
+        timestamp = post_id_timestamp(post_id)
+        if timestamp is None:
+            return os.path.join(self._posts_path, post_id + ".yaml")
 
-    def load_posts(self, top_post_id: PostID) -> list[Post]:
-        self._populate_post_cache()
+        return os.path.join(
+            self._posts_path,
+            f"{timestamp.year:04}",
+            f"{timestamp.month:02}",
+            post_id + ".yaml",
+        )
 
-        return self._collect_post_tree(top_post_id=top_post_id)
+    @property
+    def _post_aliases_path(self) -> str:
+        return os.path.join(self._base_path, "post_aliases.yaml")
+
+    def resolve_post_id(self, *, post_id: PostID) -> PostID:
+        # posts renamed by migrate_legacy_post_ids stay reachable by their
+        # old ids
+        if self._post_exists_in_repository(post_id=post_id):
+            return post_id
+
+        return self._load_post_aliases().get(post_id, post_id)
+
+    def _load_post_aliases(self) -> dict[PostID, PostID]:
+        try:
+            signature = FileSignature.from_stat(os.stat(self._post_aliases_path))
+        except FileNotFoundError:
+            return {}
+
+        if self._post_aliases_signature != signature:
+            with self._open_repository_file(
+                path=self._post_aliases_path, mode="rb"
+            ) as f:
+                self._post_aliases = yaml.load(f, Loader=YamlLoader) or {}
+            self._post_aliases_signature = signature
+
+        return self._post_aliases
+
+    def _save_post_aliases(self, *, aliases: dict[PostID, PostID]) -> None:
+        with self._open_repository_file(path=self._post_aliases_path, mode="wt") as f:
+            yaml.dump(dict(aliases), f, Dumper=YamlDumper)
+
+    def migrate_legacy_post_ids(self) -> dict[PostID, PostID]:
+        # moves every post with an undated id into a time-ordered id and its
+        # shard, rewriting the context of replies to match. The aliases are
+        # saved before anything moves, so an interrupted run can be repeated.
+        aliases = dict(self._load_post_aliases())
+
+        self._rescan_post_files_now()
+        legacy_records = sorted(
+            (
+                record
+                for record in self._posts.values()
+                if post_id_timestamp(record.id) is None
+            ),
+            key=lambda record: record.timestamp,
+        )
+        for legacy_record in legacy_records:
+            if legacy_record.id not in aliases:
+                aliases[legacy_record.id] = self.new_post_id(
+                    timestamp=legacy_record.timestamp
+                )
+        self._save_post_aliases(aliases=aliases)
+
+        renamed = {record.id: aliases[record.id] for record in legacy_records}
+        for record in list(self._posts.values()):
+            post = record.to_post()
+            context = [aliases.get(parent_id, parent_id) for parent_id in post.context]
+            if post.id not in renamed and context == post.context:
+                continue
 
-    def _collect_post_tree(self, top_post_id: PostID) -> list[Post]:
-        post_backlinks: dict[PostID, set[PostID]] = defaultdict(set)
+            new_post = post.model_copy(
+                update={"id": renamed.get(post.id, post.id), "context": context}
+            )
+            content = self.load_post_content(post_id=post.id)
+            self._write_post(post=new_post, content=content)
+
+        for old_post_id in renamed:
+            os.remove(self._post_path(post_id=old_post_id))
+
+        self._journal.record(kind="posts", keys=list(renamed) + list(renamed.values()))
+        self._rescan_post_files_now()
+
+        return renamed
+
+    def _rescan_post_files_now(self) -> None:
+        with self._post_cache_lock:
+            self._rescan_post_files()
+
+    def load_posts_since(self, *, since: datetime) -> list[Post]:
+        # only reads the shards from the month of `since` onwards
+        if since.tzinfo is not None:
+            # post timestamps are naive utc
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+
+        with self._post_cache_lock:
+            entries = self._scan_post_files(since=since)
+            changed_records: list[SnapshotRecord] = []
+            for entry in entries:
+                record = self._reload_post_if_changed(
+                    post_id=self._post_id_from_filename(entry.name),
+                    signature=FileSignature.from_stat(entry.stat()),
+                )
+                if record is not None:
+                    changed_records.append(record)
+
+            self._finish_post_refresh(
+                changed_records=changed_records, removed_post_ids=set()
+            )
 
-        for post in self._posts.values():
-            for context_id in post.context:
-                post_backlinks[context_id].add(post.id)
+            records = [
+                self._posts[self._post_id_from_filename(entry.name)]
+                for entry in entries
+            ]
 
-        sorted_post_backlinks = {
-            parent_post_id: sorted(
-                backlink_ids, key=lambda post_id: self._posts[post_id].timestamp
+        return [
+            record.to_post()
+            for record in sorted(
+                (record for record in records if record.timestamp >= since),
+                key=lambda record: (record.timestamp, record.id),
             )
-            for parent_post_id, backlink_ids in post_backlinks.items()
-        }
+        ]
 
-        related_post_ids = []
-        posts_to_check = [top_post_id]
-        while posts_to_check:
-            post_id = posts_to_check.pop(0)
-            if post_id not in related_post_ids:
-                related_post_ids.append(post_id)
-            for post_backlink_id in sorted_post_backlinks.get(post_id, []):
-                posts_to_check.append(post_backlink_id)
+    def load_posts(self, top_post_id: PostID) -> list[Post]:
+        self._populate_post_cache()
+
+        with self._post_cache_lock:
+            # the thread's own files are checked on every load, so that edits
+            # made without the repository show up in it, and in its ETag, at
+            # once rather than at the next full rescan
+            if top_post_id in self.post_graph:
+                self._refresh_posts(
+                    post_ids=self.post_graph.collect_thread(top_post_id)
+                )
+            return self._collect_post_tree(top_post_id=top_post_id)
+
+    def _collect_post_tree(self, top_post_id: PostID) -> list[Post]:
+        # callers hold _post_cache_lock
+        if top_post_id not in self.post_graph:
+            raise DoesNotExistException(f"{top_post_id} could not be found")
 
-        return list(self._posts[post_id] for post_id in related_post_ids)
+        return [
+            self._posts[post_id].to_post()
+            for post_id in self.post_graph.collect_thread(top_post_id)
+        ]
 
     def load_post_content(self, *, post_id: PostID) -> str:
         self._post_must_exist(post_id=post_id)
 
-        with self._open_post_file(post_id=post_id, mode="rt") as f:
-            _, content = self._load_yaml_prefix_and_content(f)
+        with self._open_post_file(post_id=post_id, mode="rb") as f:
+            cached_file = self._post_files.get(post_id)
+            signature = FileSignature.from_stat(os.fstat(f.fileno()))
+
+            if cached_file and cached_file.signature == signature:
+                body_offset = cached_file.body_offset
+            else:
+                body_offset = self._find_body_offset(f)
 
-            return content
+            return self._load_content(f, body_offset=body_offset)
 
     def create_post(self, *, post: Post, content: str) -> None:
         if self._post_exists_in_repository(post_id=post.id):
             raise Exception("This post already exists")
 
+        cached_file = self._write_post(post=post, content=content)
+        self._journal.record(kind="posts", keys=[post.id])
+
+        with self._post_cache_lock:
+            record = self._cache_post(post=post, cached_file=cached_file)
+            self._update_snapshot(
+                kind="posts",
+                records=[
+                    self._post_snapshot_record(record=record, cached_file=cached_file)
+                ],
+            )
+            self._reindex_posts(post_ids=[post.id])
+
+    def bulk_create(
+        self,
+        *,
+        users: Iterable[Tuple[User, str]] = (),
+        posts: Iterable[Tuple[Post, str]] = (),
+        max_workers: Optional[int] = None,
+    ) -> None:
+        # for imports: one check against the caches instead of a stat per
+        # item, the files written in parallel, then the journal, snapshot and
+        # search index each updated once
+        users = list(users)
+        posts = list(posts)
+        self._ensure_users_path()
+        self._ensure_posts_path()
+        self._populate_user_cache()
+        self._populate_post_cache()
+
+        existing = [
+            user.username for user, _ in users if user.username in self._users
+        ] + [post.id for post, _ in posts if post.id in self._posts]
+        if existing:
+            raise Exception(f"These already exist: {', '.join(existing[:10])}")
+
+        for shard_path in {
+            os.path.dirname(self._post_path(post_id=post.id)) for post, _ in posts
+        }:
+            os.makedirs(shard_path, exist_ok=True)
+
+        # serializing is most of the work, so the batches are written by
+        # worker processes; a few batches each rather than a task per file
+        max_workers = max_workers or os.cpu_count() or 1
+        batch_size = max(1, len(posts) // (max_workers * 4))
+        with contextlib.ExitStack() as stack:
+            map_batches: Callable = map
+            if max_workers > 1:
+                map_batches = stack.enter_context(
+                    ProcessPoolExecutor(
+                        max_workers=max_workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                ).map
+
+            user_files = [
+                cached_file
+                for batch in map_batches(
+                    _write_users_batch,
+                    itertools.repeat(self._base_path),
+                    _batches(users, size=batch_size),
+                )
+                for cached_file in batch
+            ]
+            post_files = [
+                cached_file
+                for batch in map_batches(
+                    _write_posts_batch,
+                    itertools.repeat(self._base_path),
+                    _batches(posts, size=batch_size),
+                )
+                for cached_file in batch
+            ]
+
+        if users:
+            self._journal.record(
+                kind="users", keys=[user.username for user, _ in users]
+            )
+            with self._user_cache_lock:
+                for (user, _), cached_file in zip(users, user_files):
+                    self._cache_user(user=user, cached_file=cached_file)
+                self._update_snapshot(
+                    kind="users",
+                    records=[
+                        self._user_snapshot_record(user=user, cached_file=cached_file)
+                        for (user, _), cached_file in zip(users, user_files)
+                    ],
+                )
+                self._reindex_users(usernames=[user.username for user, _ in users])
+
+        if posts:
+            self._journal.record(kind="posts", keys=[post.id for post, _ in posts])
+            with self._post_cache_lock:
+                snapshot_records = [
+                    self._post_snapshot_record(
+                        record=self._cache_post(post=post, cached_file=cached_file),
+                        cached_file=cached_file,
+                    )
+                    for (post, _), cached_file in zip(posts, post_files)
+                ]
+                self._update_snapshot(kind="posts", records=snapshot_records)
+                self._reindex_posts(
+                    post_ids=[post.id for post, _ in posts],
+                    contents={post.id: content for post, content in posts},
+                )
+
+    def _write_post(
+        self, *, post: Post, content: str, make_shard: bool = True
+    ) -> CachedFile:
+        path = self._post_path(post_id=post.id)
+        if make_shard:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
         with self._open_post_file(post_id=post.id, mode="wt") as f:
-            self._write_yaml_prefix_and_content(
+            body_offset = self._write_yaml_prefix_and_content(
                 f=f, data=self._post_to_dict(post=post), content=content
             )
 
+        return CachedFile(
+            signature=FileSignature.from_stat(os.stat(path)),
+            body_offset=body_offset,
+        )
+
     def _post_to_dict(self, *, post: Post) -> dict:
         d = post.dict()
         return d
+
+    def _user_jobs_path(self, *, username: Username) -> str:
+        return os.path.join(self._jobs_path, username)
+
+    def _job_path(
+        self, *, username: Username, source_filename: str, extension: str = ".yaml"
+    ) -> str:
+        # a user's job for an image is found without reading any other job
+        return os.path.join(
+            self._user_jobs_path(username=username), source_filename + extension
+        )
+
+    def save_thumbnail_job(self, *, job: ThumbnailJob) -> None:
+        os.makedirs(self._user_jobs_path(username=job.username), exist_ok=True)
+
+        with self._open_repository_file(
+            path=self._job_path(
+                username=job.username, source_filename=job.source_filename
+            ),
+            mode="wt",
+        ) as f:
+            yaml.dump(job.model_dump(), f, Dumper=YamlDumper)
+
+    def load_all_thumbnail_jobs(self) -> list[ThumbnailJob]:
+        if not os.path.exists(self._jobs_path):
+            return []
+
+        jobs = []
+        for entry in os.scandir(self._jobs_path):
+            if entry.is_dir():
+                jobs.extend(
+                    self.load_user_thumbnail_jobs(
+                        username=self._username_from_filename(entry.name)
+                    )
+                )
+
+        return jobs
+
+    def load_user_thumbnail_jobs(self, *, username: Username) -> list[ThumbnailJob]:
+        try:
+            entries = list(os.scandir(self._user_jobs_path(username=username)))
+        except FileNotFoundError:
+            return []
+
+        jobs = []
+        for entry in entries:
+            if not (entry.is_file() and entry.name.endswith(".yaml")):
+                continue
+
+            try:
+                jobs.append(self._load_thumbnail_job_file(path=entry.path))
+            except FileNotFoundError:
+                # finished by another process since the scan
+                continue
+
+        return jobs
+
+    def load_thumbnail_job(
+        self, *, username: Username, source_filename: str
+    ) -> ThumbnailJob:
+        try:
+            return self._load_thumbnail_job_file(
+                path=self._job_path(username=username, source_filename=source_filename)
+            )
+        except FileNotFoundError:
+            raise DoesNotExistException(
+                f"no job for {username}'s {source_filename} could be found"
+            )
+
+    def _load_thumbnail_job_file(self, *, path: str) -> ThumbnailJob:
+        with self._open_repository_file(path=path, mode="rb") as f:
+            return ThumbnailJob.model_validate(yaml.load(f, Loader=YamlLoader))
+
+    def delete_thumbnail_job(self, *, job: ThumbnailJob) -> None:
+        try:
+            os.remove(
+                self._job_path(
+                    username=job.username, source_filename=job.source_filename
+                )
+            )
+        except FileNotFoundError:
+            pass
+
+    def claim_thumbnail_job(self, *, job: ThumbnailJob) -> Optional[int]:
+        # every worker process resumes the pending jobs, so each one takes an
+        # exclusive lock on the job's claim file first, and only the one that
+        # gets it runs the job. The lock is held until the claim is released,
+        # or the process exits, so a crashed worker's jobs can be claimed again
+        os.makedirs(self._user_jobs_path(username=job.username), exist_ok=True)
+
+        claim = os.open(
+            self._job_path(
+                username=job.username,
+                source_filename=job.source_filename,
+                extension=".claim",
+            ),
+            os.O_CREAT | os.O_WRONLY,
+        )
+        try:
+            fcntl.flock(claim, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(claim)
+            return None
+
+        return claim
+
+    def release_thumbnail_job_claim(self, *, job: ThumbnailJob, claim: int) -> None:
+        # only once the job is done or has failed: a process that opened the
+        # claim file before it was removed, and locks it after, finds that
+        try:
+            os.remove(
+                self._job_path(
+                    username=job.username,
+                    source_filename=job.source_filename,
+                    extension=".claim",
+                )
+            )
+        except FileNotFoundError:
+            pass
+        os.close(claim)
+
+
+def _write_users_batch(
+    base_path: str, batch: list[Tuple[User, str]]
+) -> list[CachedFile]:
+    repository = Repository(base_path)
+    return [
+        repository._write_user(username=user.username, user=user, content=content)
+        for user, content in batch
+    ]
+
+
+def _write_posts_batch(
+    base_path: str, batch: list[Tuple[Post, str]]
+) -> list[CachedFile]:
+    repository = Repository(base_path)
+    return [
+        repository._write_post(post=post, content=content, make_shard=False)
+        for post, content in batch
+    ]
+
+
+def _batches(items: list, *, size: int) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
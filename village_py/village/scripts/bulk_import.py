@@ -0,0 +1,336 @@
+# run as `poetry run bulk-import ARCHIVE [--format jsonl|mbox] [--dry-run]`
+#
+# Imports users and posts from an archive of another forum. Everything is
+# validated before anything is written; then the files are written in
+# parallel and the caches and search index are built once.
+#
+# JSON Lines archives hold one object per line:
+#
+#   {"type": "user", "username": "...", "display_name": "...",
+#    "password": "...", "content": "..."}
+#   {"type": "post", "id": "...", "author": "...", "timestamp": "...",
+#    "title": "...", "content": "...", "context": ["...", ...]}
+#
+# where post ids are the archive's own; they are replaced with new ids, and
+# context may also name posts already in the repository. The new ids are
+# derived from the archive's ids (and Message-IDs), so importing an archive
+# again skips the posts it already imported rather than duplicating them. In mbox archives each
+# message is a post, threaded by In-Reply-To and References, and senders
+# become users named after the local part of their address. Users without a
+# password get a random one and must reset it (see force-reset-password).
+
+import argparse
+import email.utils
+import json
+import mailbox
+import os
+import re
+import secrets
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.header import decode_header, make_header
+from email.message import Message
+from typing import Optional
+
+from pydantic import ValidationError
+
+from village.models.posts import Post, PostID, new_time_ordered_post_id
+from village.models.users import User, Username
+from village.repository import Repository
+
+USERNAME_INVALID_CHARACTERS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class ImportException(Exception):
+    pass
+
+
+@dataclass
+class ArchiveUser:
+    username: str
+    display_name: str
+    password: Optional[str] = None
+    content: str = ""
+
+
+@dataclass
+class ArchivePost:
+    archive_id: str
+    author: str
+    timestamp: datetime
+    title: str
+    content: str
+    context: list[str] = field(default_factory=list)
+
+
+@dataclass
+class Archive:
+    users: list[ArchiveUser] = field(default_factory=list)
+    posts: list[ArchivePost] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+
+def read_jsonl_archive(path: str) -> Archive:
+    archive = Archive()
+
+    with open(path, "rt", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                item = json.loads(line)
+                if item.get("type") == "user":
+                    archive.users.append(
+                        ArchiveUser(
+                            username=item["username"],
+                            display_name=item.get("display_name") or item["username"],
+                            password=item.get("password"),
+                            content=item.get("content", ""),
+                        )
+                    )
+                elif item.get("type") == "post":
+                    archive.posts.append(
+                        ArchivePost(
+                            archive_id=str(item["id"]),
+                            author=item["author"],
+                            timestamp=_as_naive_utc(
+                                datetime.fromisoformat(item["timestamp"])
+                            ),
+                            title=item["title"],
+                            content=item.get("content", ""),
+                            context=[str(parent) for parent in item.get("context", [])],
+                        )
+                    )
+                else:
+                    raise ImportException(f"unknown type {item.get('type')!r}")
+            except (ValueError, KeyError, TypeError, ImportException) as e:
+                archive.errors.append(f"line {line_number}: {e!r}")
+
+    return archive
+
+
+def read_mbox_archive(path: str) -> Archive:
+    archive = Archive()
+    display_names: dict[str, str] = {}
+
+    for message_number, message in enumerate(mailbox.mbox(path), start=1):
+        try:
+            display_name, address = email.utils.parseaddr(
+                _header(message, "From") or ""
+            )
+            if not address:
+                raise ImportException("no From address")
+
+            username = _username_for_address(address)
+            display_names.setdefault(username, display_name or username)
+
+            message_id = _header(message, "Message-ID")
+            date = _header(message, "Date")
+            if not message_id or not date:
+                raise ImportException("no Message-ID or Date")
+
+            in_reply_to = _message_ids(_header(message, "In-Reply-To"))
+            references = _message_ids(_header(message, "References"))
+
+            archive.posts.append(
+                ArchivePost(
+                    archive_id=message_id.strip(),
+                    author=username,
+                    timestamp=_as_naive_utc(email.utils.parsedate_to_datetime(date)),
+                    title=_header(message, "Subject") or "(no subject)",
+                    content=_plain_text_body(message),
+                    context=in_reply_to or references[-1:],
+                )
+            )
+        except (ValueError, TypeError, ImportException) as e:
+            archive.errors.append(f"message {message_number}: {e!r}")
+
+    archive.users = [
+        ArchiveUser(username=username, display_name=display_name)
+        for username, display_name in display_names.items()
+    ]
+
+    return archive
+
+
+def _header(message: Message, name: str) -> Optional[str]:
+    value = message.get(name)
+    if value is None:
+        return None
+    return str(make_header(decode_header(value)))
+
+
+def _message_ids(value: Optional[str]) -> list[str]:
+    return re.findall(r"<[^>]+>", value or "")
+
+
+def _username_for_address(address: str) -> str:
+    local_part = address.split("@", 1)[0]
+    return USERNAME_INVALID_CHARACTERS.sub("_", local_part) or "_"
+
+
+def _plain_text_body(message: Message) -> str:
+    for part in message.walk():
+        if part.get_content_type() == "text/plain":
+            payload = part.get_payload(decode=True)
+            if isinstance(payload, bytes):
+                charset = part.get_content_charset() or "utf-8"
+                return payload.decode(charset, errors="replace")
+    return ""
+
+
+def _as_naive_utc(timestamp: datetime) -> datetime:
+    # post timestamps are naive utc
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def prepare_import(
+    repository: Repository, archive: Archive
+) -> tuple[list[tuple[User, str]], list[tuple[Post, str]], list[str]]:
+    errors = list(archive.errors)
+    warnings = []
+
+    existing_users = {user.username: user for user in repository.load_all_users()}
+    existing_usernames = set(existing_users)
+    # fills the post graph, for replies to posts already in the repository
+    # and for posts imported before
+    repository.load_all_top_level_posts()
+
+    users: list[tuple[User, str]] = []
+    for archive_user in archive.users:
+        existing_user = existing_users.get(Username(archive_user.username))
+        if existing_user is not None:
+            # unless imported before, with the same password
+            if archive_user.password is not None and not existing_user.check_password(
+                password=archive_user.password
+            ):
+                errors.append(f"user {archive_user.username} already exists")
+            continue
+
+        try:
+            user = User.create_new_user(
+                username=Username(archive_user.username),
+                display_name=archive_user.display_name,
+                password=archive_user.password or secrets.token_urlsafe(),
+            )
+        except ValidationError as e:
+            errors.append(f"user {archive_user.username}: {e}")
+            continue
+
+        users.append((user, archive_user.content))
+        existing_usernames.add(user.username)
+
+    # parents first, so that the new ids sort the same way as the posts
+    archive_posts = sorted(archive.posts, key=lambda post: post.timestamp)
+    post_ids: dict[str, PostID] = {}
+    for archive_post in archive_posts:
+        if archive_post.archive_id in post_ids:
+            errors.append(f"post {archive_post.archive_id} appears more than once")
+        post_ids[archive_post.archive_id] = new_time_ordered_post_id(
+            archive_post.timestamp,
+            source_key=f"{archive_post.author}:{archive_post.archive_id}",
+        )
+
+    posts: list[tuple[Post, str]] = []
+    already_imported = 0
+    for archive_post in archive_posts:
+        if post_ids[archive_post.archive_id] in repository.post_graph:
+            already_imported += 1
+            continue
+
+        if archive_post.author not in existing_usernames:
+            errors.append(
+                f"post {archive_post.archive_id}: no user {archive_post.author}"
+            )
+            continue
+
+        context = []
+        for parent_id in archive_post.context:
+            if parent_id in post_ids:
+                context.append(post_ids[parent_id])
+            elif PostID(parent_id) in repository.post_graph:
+                context.append(PostID(parent_id))
+            else:
+                warnings.append(
+                    f"post {archive_post.archive_id}: dropped reply to unknown "
+                    f"post {parent_id}"
+                )
+
+        try:
+            post = Post(
+                id=post_ids[archive_post.archive_id],
+                author=Username(archive_post.author),
+                timestamp=archive_post.timestamp,
+                title=archive_post.title,
+                context=context,
+                upload_filename=None,
+            )
+        except ValidationError as e:
+            errors.append(f"post {archive_post.archive_id}: {e}")
+            continue
+
+        posts.append((post, archive_post.content))
+
+    if already_imported:
+        warnings.append(f"skipped {already_imported} posts imported before")
+    for warning in warnings:
+        print(f"warning: {warning}", file=sys.stderr)
+
+    return users, posts, errors
+
+
+def _read_archive(path: str, archive_format: str) -> Archive:
+    if archive_format == "mbox":
+        return read_mbox_archive(path)
+    return read_jsonl_archive(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archive")
+    parser.add_argument("--format", choices=("jsonl", "mbox"))
+    parser.add_argument("--repository", default="~/test-repository")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="validate, but write nothing"
+    )
+    args = parser.parse_args()
+
+    archive_format = args.format or (
+        "jsonl" if args.archive.endswith((".jsonl", ".json")) else "mbox"
+    )
+    # the same caches as the server, so that they are built here, once
+    repository = Repository(
+        os.path.expanduser(args.repository), use_snapshot=True, use_search_index=True
+    )
+
+    started_at = time.perf_counter()
+    archive = _read_archive(args.archive, archive_format)
+    users, posts, errors = prepare_import(repository, archive)
+    if errors:
+        for error in errors[:50]:
+            print(f"error: {error}", file=sys.stderr)
+        raise SystemExit(f"nothing imported: {len(errors)} errors")
+
+    prepared_at = time.perf_counter()
+    if not args.dry_run:
+        repository.bulk_create(users=users, posts=posts, max_workers=args.workers)
+    finished_at = time.perf_counter()
+
+    write_seconds = finished_at - prepared_at
+    print(
+        f"{'validated' if args.dry_run else 'imported'} {len(users)} users and "
+        f"{len(posts)} posts in {finished_at - started_at:.1f}s "
+        f"(reading and validating {prepared_at - started_at:.1f}s, "
+        f"writing {write_seconds:.1f}s, "
+        f"{len(posts) / max(finished_at - started_at, 1e-9):.0f} posts/sec)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# run as `poetry run chat-server [--host 127.0.0.1] [--port 5001]`
+#
+# Serves /chat/api/ for the chat pages of the main app; put both behind the
+# same host so that the session cookie is shared (see dev-server.md).
+
+import argparse
+import asyncio
+import os
+
+from village.chat import ChatServer
+from village.repository import Repository
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--max-messages-per-room", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ChatServer(
+        repository=Repository(os.path.expanduser("~/test-repository")),
+        secret_key=os.environ["FLASK_SECRET_KEY"].encode("utf-8"),
+        max_messages_per_room=args.max_messages_per_room,
+    )
+
+    asyncio.run(server.serve(host=args.host, port=args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# run as `poetry run export-repository OUTPUT.tar [--since PREVIOUS.manifest.jsonl]`
+#
+# Streams a tar of the repository (everything but cache/) to OUTPUT, or to
+# stdout with `-` and --archive-name, and writes OUTPUT's manifest next to it.
+# With --since, only files whose size or mtime changed since that manifest go
+# into the tar, so nightly backups cost about as much I/O as the day's
+# changes. Keep every archive a manifest refers to; restore-repository needs
+# them all.
+
+import argparse
+import os
+import sys
+
+from village.backup import export_repository, load_manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output")
+    parser.add_argument("--since", help="the manifest of the previous export")
+    parser.add_argument("--manifest", help="defaults to OUTPUT.manifest.jsonl")
+    parser.add_argument("--archive-name", help="defaults to OUTPUT's filename")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--repository", default="~/test-repository")
+    args = parser.parse_args()
+
+    if args.output == "-" and not (args.archive_name and args.manifest):
+        raise SystemExit("writing to stdout needs --archive-name and --manifest")
+
+    archive_name = args.archive_name or os.path.basename(args.output)
+    manifest_path = args.manifest or args.output + ".manifest.jsonl"
+    previous = load_manifest(args.since) if args.since else None
+
+    temporary_manifest_path = manifest_path + ".tmp"
+    with open(temporary_manifest_path, "wt", encoding="utf-8") as manifest_output:
+        if args.output == "-":
+            stats = export_repository(
+                repository_path=os.path.expanduser(args.repository),
+                output=sys.stdout.buffer,
+                archive_name=archive_name,
+                manifest_output=manifest_output,
+                previous=previous,
+                compress=args.gzip,
+            )
+        else:
+            with open(args.output, "xb") as output:
+                stats = export_repository(
+                    repository_path=os.path.expanduser(args.repository),
+                    output=output,
+                    archive_name=archive_name,
+                    manifest_output=manifest_output,
+                    previous=previous,
+                    compress=args.gzip,
+                )
+    os.replace(temporary_manifest_path, manifest_path)
+
+    print(
+        f"{stats.changed_files} of {stats.files} files changed, "
+        f"{stats.changed_bytes} bytes exported to {archive_name}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
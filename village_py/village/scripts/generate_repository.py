@@ -0,0 +1,245 @@
+# run as `poetry run generate-repository PATH [--users N] [--posts M] ...`
+#
+# Fills PATH with synthetic users, threads and avatar images for benchmarking.
+# Every generated user's password is "password".
+
+import argparse
+import os
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from PIL import Image
+from PIL.Image import Transpose
+
+from village.images.thumbnails import make_and_save_thumbnail_for_file
+from village.models.posts import Post, PostID
+from village.models.users import User, Username
+from village.repository import Repository
+
+GENERATED_PASSWORD = "password"
+
+WORDS = (
+    "village garden bread river window lantern market harvest orchard bridge "
+    "winter kettle letter meadow pottery workshop festival chimney stone path "
+    "apple fence ladder quilt candle barn mill well story rain supper neighbour "
+    "the a of and to in is was it for on with as at by this that we our"
+).split()
+
+
+@dataclass
+class GeneratorSettings:
+    users: int = 50
+    posts: int = 1000
+    max_depth: int = 6
+    max_fan_out: int = 4
+    multi_parent_fraction: float = 0.1
+    median_body_words: int = 80
+    body_words_sigma: float = 1.0
+    avatar_fraction: float = 0.5
+    avatar_max_side: int = 2000
+    seed: int = 0
+
+
+def generate_repository(path: str, settings: GeneratorSettings) -> Repository:
+    for directory in ("users", "posts", "uploads"):
+        os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    repository = Repository(path)
+    rng = random.Random(settings.seed)
+
+    usernames = _generate_users(repository, rng, settings)
+    _generate_posts(repository, rng, settings, usernames)
+
+    return repository
+
+
+def _generate_users(
+    repository: Repository, rng: random.Random, settings: GeneratorSettings
+) -> list[Username]:
+    # hashing is deliberately slow, so every user shares one salt and hash
+    template = User.create_new_user(
+        username=Username("template"),
+        display_name="template",
+        password=GENERATED_PASSWORD,
+    )
+    template.new_password_required = False
+
+    usernames = []
+    for n in range(settings.users):
+        user = template.model_copy(
+            update={
+                "username": Username(f"user{n:05}"),
+                "display_name": _words(rng, rng.randint(1, 3)).title(),
+            }
+        )
+
+        if rng.random() < settings.avatar_fraction:
+            user.image_filename, user.image_thumbnail = _generate_avatar(
+                repository, rng, settings
+            )
+
+        repository.create_user(user=user)
+        repository.update_user_content(
+            username=user.username, content=_body(rng, settings)
+        )
+        usernames.append(user.username)
+
+    return usernames
+
+
+def _generate_avatar(
+    repository: Repository, rng: random.Random, settings: GeneratorSettings
+) -> tuple[str, str]:
+    width = rng.randint(64, settings.avatar_max_side)
+    height = rng.randint(64, settings.avatar_max_side)
+    image = Image.radial_gradient("L").resize((width, height))
+    image = Image.merge(
+        "RGB",
+        (
+            image,
+            image.rotate(rng.randint(0, 359)),
+            image.transpose(Transpose.FLIP_LEFT_RIGHT),
+        ),
+    )
+
+    extension = rng.choice((".jpg", ".png"))
+    image_filename = repository.new_upload_filename(suffix=extension)
+    image.save(repository.upload_path_for(filename=image_filename))
+
+    thumbnail_filename = repository.new_upload_filename(suffix=extension)
+    make_and_save_thumbnail_for_file(
+        repository.upload_path_for(filename=image_filename),
+        repository.upload_path_for(filename=thumbnail_filename),
+    )
+
+    return image_filename, thumbnail_filename
+
+
+def _generate_posts(
+    repository: Repository,
+    rng: random.Random,
+    settings: GeneratorSettings,
+    usernames: list[Username],
+) -> None:
+    timestamp = datetime(2020, 1, 1)
+    remaining = settings.posts
+
+    while remaining > 0:
+        timestamp += timedelta(minutes=rng.randint(1, 600))
+        top_post = _create_post(repository, rng, settings, usernames, timestamp, [])
+        remaining -= 1
+
+        # (post, depth) pairs that may still receive replies
+        frontier = [(top_post, 0)]
+        while frontier and remaining > 0:
+            parent, depth = frontier.pop(rng.randrange(len(frontier)))
+            if depth >= settings.max_depth:
+                continue
+
+            for _ in range(rng.randint(0, settings.max_fan_out)):
+                if remaining <= 0:
+                    break
+
+                context = [parent.id]
+                if frontier and rng.random() < settings.multi_parent_fraction:
+                    context.append(rng.choice(frontier)[0].id)
+
+                timestamp += timedelta(minutes=rng.randint(1, 60))
+                reply = _create_post(
+                    repository, rng, settings, usernames, timestamp, context
+                )
+                remaining -= 1
+                frontier.append((reply, depth + 1))
+
+
+def _create_post(
+    repository: Repository,
+    rng: random.Random,
+    settings: GeneratorSettings,
+    usernames: list[Username],
+    timestamp: datetime,
+    context: list[PostID],
+) -> Post:
+    post = Post(
+        id=repository.new_post_id(timestamp=timestamp),
+        author=rng.choice(usernames),
+        timestamp=timestamp,
+        title=_words(rng, rng.randint(2, 8)).capitalize(),
+        context=context,
+        upload_filename=None,
+    )
+    repository.create_post(post=post, content=_body(rng, settings))
+
+    return post
+
+
+def _body(rng: random.Random, settings: GeneratorSettings) -> str:
+    word_count = int(
+        rng.lognormvariate(0, settings.body_words_sigma) * settings.median_body_words
+    )
+
+    paragraphs = []
+    while word_count > 0:
+        paragraph_words = min(word_count, rng.randint(20, 120))
+        paragraph = _words(rng, paragraph_words).capitalize() + "."
+        if rng.random() < 0.2:
+            paragraph = "*" + paragraph + "*"
+        paragraphs.append(paragraph)
+        word_count -= paragraph_words
+
+    return "\n\n".join(paragraphs) + "\n"
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choices(WORDS, k=count))
+
+
+def main() -> None:
+    defaults = GeneratorSettings()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--posts", type=int, default=defaults.posts)
+    parser.add_argument("--max-depth", type=int, default=defaults.max_depth)
+    parser.add_argument("--max-fan-out", type=int, default=defaults.max_fan_out)
+    parser.add_argument(
+        "--multi-parent-fraction", type=float, default=defaults.multi_parent_fraction
+    )
+    parser.add_argument(
+        "--median-body-words", type=int, default=defaults.median_body_words
+    )
+    parser.add_argument(
+        "--body-words-sigma", type=float, default=defaults.body_words_sigma
+    )
+    parser.add_argument(
+        "--avatar-fraction", type=float, default=defaults.avatar_fraction
+    )
+    parser.add_argument("--avatar-max-side", type=int, default=defaults.avatar_max_side)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    path = os.path.expanduser(args.path)
+    if os.path.exists(path) and os.listdir(path):
+        raise Exception(f"{path} is not empty")
+
+    generate_repository(
+        path,
+        GeneratorSettings(
+            users=args.users,
+            posts=args.posts,
+            max_depth=args.max_depth,
+            max_fan_out=args.max_fan_out,
+            multi_parent_fraction=args.multi_parent_fraction,
+            median_body_words=args.median_body_words,
+            body_words_sigma=args.body_words_sigma,
+            avatar_fraction=args.avatar_fraction,
+            avatar_max_side=args.avatar_max_side,
+            seed=args.seed,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+# run as `poetry run migrate-post-ids` with the server stopped
+#
+# Gives every post that still has a random (uuid4) id a time-ordered one and
+# moves it into its posts/YYYY/MM/ shard. Old ids keep working through
+# post_aliases.yaml.
+
+import os
+
+from village.repository import Repository
+
+
+def main() -> None:
+    repository = Repository(os.path.expanduser("~/test-repository"))
+
+    renamed = repository.migrate_legacy_post_ids()
+
+    for old_post_id, new_post_id in renamed.items():
+        print(f"{old_post_id} -> {new_post_id}")
+    print(f"migrated {len(renamed)} posts")
+
+
+if __name__ == "__main__":
+    main()
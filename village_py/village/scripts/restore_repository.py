@@ -0,0 +1,32 @@
+# run as `poetry run restore-repository MANIFEST TARGET [--archives DIRECTORY]`
+#
+# Rebuilds a repository, as it was when MANIFEST was exported, in the empty
+# directory TARGET. Every archive the manifest refers to must be in
+# --archives (by default, the manifest's directory). Each file is checked
+# against its hash.
+
+import argparse
+import os
+
+from village.backup import load_manifest, restore_repository
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest")
+    parser.add_argument("target")
+    parser.add_argument("--archives")
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    restored = restore_repository(
+        manifest=manifest,
+        archives_path=args.archives or os.path.dirname(os.path.abspath(args.manifest)),
+        target_path=os.path.expanduser(args.target),
+    )
+
+    print(f"restored {restored} files from {manifest.archive} and earlier exports")
+
+
+if __name__ == "__main__":
+    main()
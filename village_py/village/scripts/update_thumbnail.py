@@ -5,6 +5,7 @@ from PIL import Image
 from village.models.users import User, Username
 from village.repository import Repository
 from village.images.thumbnails import make_and_save_thumbnail
+from village.images.variants import make_and_save_variants_for_file
 
 
 def main() -> None:
@@ -16,7 +17,6 @@ def main() -> None:
 
     assert user.image_filename
     img = Image.open(repository.upload_path_for(filename=user.image_filename))
-    img.load()
     print(img.size)
 
     _, extension = os.path.splitext(user.image_filename)
@@ -27,6 +27,11 @@ def main() -> None:
 
     user.image_thumbnail = new_thumbnail_filename
     print(new_thumbnail_filename)
+
+    user.image_variant_widths = make_and_save_variants_for_file(
+        repository.upload_path_for(filename=user.image_filename)
+    )
+    print(user.image_variant_widths)
     repository.update_user(user=user)
 
 
@@ -0,0 +1,272 @@
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional, Tuple
+
+SEARCH_INDEX_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"\w\w+")
+
+
+@lru_cache(maxsize=1024)
+def _term_weight(count: int) -> float:
+    return 1 + math.log(count)
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class DocumentText(NamedTuple):
+    key: str
+    mtime_ns: int
+    size: int
+    inode: int
+    text: str
+
+
+class IndexedDocument(NamedTuple):
+    key: str
+    mtime_ns: int
+    size: int
+    inode: int
+    term_counts: dict[str, int]
+
+
+class SearchResult(NamedTuple):
+    key: str
+    score: float
+
+
+class SearchIndex:
+    def __init__(self, *, path: Optional[str] = None) -> None:
+        self._path = path
+        self._lock = threading.RLock()
+
+        self._postings: dict[str, dict[str, int]] = {}
+        self._documents: dict[str, IndexedDocument] = {}
+        self._impact_orders: dict[str, list[Tuple[int, str]]] = {}
+
+        self._connection: Optional[sqlite3.Connection] = None
+        if self._path:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            self._connection = self._connect()
+
+        # reading every document back in takes a while, so it waits until the
+        # index is first used, or the server warms it up in the background
+        self._loaded = self._connection is None
+
+    def _connect(self) -> sqlite3.Connection:
+        assert self._path
+
+        connection = sqlite3.connect(self._path, check_same_thread=False)
+        if connection.execute("PRAGMA user_version").fetchone()[0] not in (
+            0,
+            SEARCH_INDEX_VERSION,
+        ):
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS documents")
+
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    key TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    term_counts TEXT NOT NULL
+                )
+                """)
+            connection.execute(f"PRAGMA user_version = {SEARCH_INDEX_VERSION}")
+
+        return connection
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def _load(self) -> None:
+        assert self._connection
+
+        rows = self._connection.execute(
+            "SELECT key, mtime_ns, size, inode, term_counts FROM documents"
+        ).fetchall()
+
+        for key, mtime_ns, size, inode, term_counts in rows:
+            self._add_to_memory(
+                IndexedDocument(
+                    key=key,
+                    mtime_ns=mtime_ns,
+                    size=size,
+                    inode=inode,
+                    term_counts=json.loads(term_counts),
+                )
+            )
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self._documents)
+
+    def keys(self) -> set[str]:
+        self.load()
+        with self._lock:
+            return set(self._documents)
+
+    def is_current(self, *, key: str, mtime_ns: int, size: int, inode: int) -> bool:
+        self.load()
+        document = self._documents.get(key)
+        return document is not None and (
+            document.mtime_ns,
+            document.size,
+            document.inode,
+        ) == (mtime_ns, size, inode)
+
+    def update(
+        self,
+        *,
+        documents: Iterable[DocumentText],
+        removed_keys: Iterable[str] = (),
+    ) -> None:
+        indexed_documents = [
+            IndexedDocument(
+                key=document.key,
+                mtime_ns=document.mtime_ns,
+                size=document.size,
+                inode=document.inode,
+                term_counts=dict(Counter(tokenize(document.text))),
+            )
+            for document in documents
+        ]
+        removed_keys = list(removed_keys)
+
+        if not indexed_documents and not removed_keys:
+            return
+
+        self.load()
+        with self._lock:
+            for key in removed_keys:
+                self._remove_from_memory(key)
+
+            for document in indexed_documents:
+                self._remove_from_memory(document.key)
+                self._add_to_memory(document)
+
+            if self._connection:
+                with self._connection:
+                    self._connection.executemany(
+                        "DELETE FROM documents WHERE key = ?",
+                        [(key,) for key in removed_keys],
+                    )
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (
+                                document.key,
+                                document.mtime_ns,
+                                document.size,
+                                document.inode,
+                                json.dumps(document.term_counts),
+                            )
+                            for document in indexed_documents
+                        ],
+                    )
+
+    def _add_to_memory(self, document: IndexedDocument) -> None:
+        self._documents[document.key] = document
+        for term, count in document.term_counts.items():
+            self._postings.setdefault(term, {})[document.key] = count
+
+            impact_order = self._impact_orders.get(term)
+            if impact_order is not None:
+                bisect.insort(impact_order, (-count, document.key))
+
+    def _remove_from_memory(self, key: str) -> None:
+        document = self._documents.pop(key, None)
+        if document is None:
+            return
+
+        for term, count in document.term_counts.items():
+            posting = self._postings[term]
+            del posting[key]
+            if not posting:
+                del self._postings[term]
+                self._impact_orders.pop(term, None)
+                continue
+
+            impact_order = self._impact_orders.get(term)
+            if impact_order is not None:
+                del impact_order[bisect.bisect_left(impact_order, (-count, key))]
+
+    def _impact_order(self, term: str) -> list[Tuple[int, str]]:
+        # a term's postings by descending count, built on first use and then
+        # kept in order as documents come and go
+        impact_order = self._impact_orders.get(term)
+        if impact_order is None:
+            impact_order = sorted(
+                (-count, key) for key, count in self._postings[term].items()
+            )
+            self._impact_orders[term] = impact_order
+
+        return impact_order
+
+    def search(self, query: str, *, limit: int = 50) -> list[SearchResult]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        self.load()
+        with self._lock:
+            if not all(term in self._postings for term in terms):
+                return []
+
+            terms.sort(key=lambda term: len(self._postings[term]))
+            document_count = len(self._documents)
+            weights = [
+                math.log(1 + document_count / len(self._postings[term]))
+                for term in terms
+            ]
+
+            # walk the rarest term's postings from its highest count down and
+            # stop once no remaining document could beat the current top results
+            rarest, *others = terms
+            other_postings = [self._postings[term] for term in others]
+            best_other_score = sum(
+                weight * _term_weight(-self._impact_order(term)[0][0])
+                for weight, term in zip(weights[1:], others)
+            )
+
+            top: list[Tuple[float, str]] = []
+            for negated_count, key in self._impact_order(rarest):
+                score = weights[0] * _term_weight(-negated_count)
+                if len(top) == limit and score + best_other_score <= top[0][0]:
+                    break
+
+                for weight, posting in zip(weights[1:], other_postings):
+                    other_count = posting.get(key)
+                    if other_count is None:
+                        break
+                    score += weight * _term_weight(other_count)
+                else:
+                    if len(top) < limit:
+                        heapq.heappush(top, (score, key))
+                    elif score > top[0][0]:
+                        heapq.heapreplace(top, (score, key))
+
+        return [
+            SearchResult(key=key, score=score)
+            for score, key in sorted(top, reverse=True)
+        ]
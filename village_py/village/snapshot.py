@@ -0,0 +1,122 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable, Literal, NamedTuple
+
+SNAPSHOT_VERSION = 1
+
+SnapshotKind = Literal["posts"] | Literal["users"]
+
+
+class SnapshotRecord(NamedTuple):
+    key: str
+    mtime_ns: int
+    size: int
+    inode: int
+    body_offset: int
+    data: dict
+
+
+class MetadataSnapshot:
+    def __init__(self, *, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        self._connection = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            connection = self._open_connection()
+            if connection.execute("PRAGMA user_version").fetchone()[0] in (
+                0,
+                SNAPSHOT_VERSION,
+            ):
+                self._create_tables(connection)
+                return connection
+
+            connection.close()
+
+        except sqlite3.DatabaseError:
+            pass
+
+        # an older format or a damaged file; it is only a cache, so start over
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self._path + suffix)
+            except FileNotFoundError:
+                pass
+        connection = self._open_connection()
+        self._create_tables(connection)
+        return connection
+
+    def _open_connection(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _create_tables(self, connection: sqlite3.Connection) -> None:
+        with connection:
+            for kind in ("posts", "users"):
+                connection.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {kind} (
+                        key TEXT PRIMARY KEY,
+                        mtime_ns INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        inode INTEGER NOT NULL,
+                        body_offset INTEGER NOT NULL,
+                        data TEXT NOT NULL
+                    )
+                    """)
+            connection.execute(f"PRAGMA user_version = {SNAPSHOT_VERSION}")
+
+    def load(self, *, kind: SnapshotKind) -> list[SnapshotRecord]:
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT key, mtime_ns, size, inode, body_offset, data FROM {kind}"
+            ).fetchall()
+
+        return [
+            SnapshotRecord(
+                key=key,
+                mtime_ns=mtime_ns,
+                size=size,
+                inode=inode,
+                body_offset=body_offset,
+                data=json.loads(data),
+            )
+            for key, mtime_ns, size, inode, body_offset, data in rows
+        ]
+
+    def update(
+        self,
+        *,
+        kind: SnapshotKind,
+        records: Iterable[SnapshotRecord],
+        removed_keys: Iterable[str] = (),
+    ) -> None:
+        rows = [
+            (
+                record.key,
+                record.mtime_ns,
+                record.size,
+                record.inode,
+                record.body_offset,
+                json.dumps(record.data, default=str),
+            )
+            for record in records
+        ]
+        removed_rows = [(key,) for key in removed_keys]
+
+        if not rows and not removed_rows:
+            return
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {kind} VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._connection.executemany(
+                f"DELETE FROM {kind} WHERE key = ?", removed_rows
+            )
@@ -0,0 +1,50 @@
+import threading
+import time
+from typing import Callable, Optional
+
+from village.metrics import global_metrics
+
+
+# Runs its steps one after another on a background thread, so that a worker
+# can take requests as soon as it has been imported. Requests never wait for
+# it: until a step has run, they load whatever they need themselves, as they
+# would after a cache miss.
+class WarmUp:
+    def __init__(self, *, steps: list[tuple[str, Callable[[], object]]]) -> None:
+        self._steps = steps
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._finished = threading.Event()
+
+        self.step_seconds: dict[str, float] = {}
+        self.errors: dict[str, str] = {}
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="warm-up", daemon=True
+                )
+                self._thread.start()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def _run(self) -> None:
+        for name, step in self._steps:
+            started_at = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                # a failed step only means requests do that work themselves
+                self.errors[name] = repr(e)
+            seconds = time.perf_counter() - started_at
+
+            self.step_seconds[name] = seconds
+            global_metrics.observe_phase(phase=f"warm_up_{name}", seconds=seconds)
+
+        self._finished.set()